@@ -1,15 +1,24 @@
 import os
 import re
+import time
+import asyncio
+import hashlib
+import hmac
 import logging
+import threading
+import contextlib
+import shlex
+import difflib
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable
 
 import smbclient
 from smbclient import open_file
+from smbprotocol.exceptions import SMBConnectionClosed
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
 # ------------------- 初始化 FastAPI 和日志 -------------------
 app = FastAPI(
@@ -19,6 +28,8 @@ app = FastAPI(
 )
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# 模块级的配置项（SMB_KEEPALIVE_INTERVAL、FANOUT_PARALLELISM 等）在导入时读取，必须先加载 .env
+load_dotenv()
 
 # ------------------- 工具函数 -------------------
 def load_smb_env_config() -> Dict[str, str]:
@@ -32,10 +43,203 @@ def load_smb_env_config() -> Dict[str, str]:
         "domain": os.getenv("DOMAIN", "")
     }
 
+def load_router_registry() -> Dict[str, "RouterConfig"]:
+    """
+    读取路由器列表：
+    - .env 中的 SERVER_IP 作为 default 路由器
+    - .env 中的 ROUTERS=名称=IP,名称=IP，使用 MYUSERNAME / MYPASSWORD 登录
+    - ROUTERS_FILE 指定的 YAML 文件（默认 routers.yaml，不存在时忽略），格式：
+        defaults: {username: root, password: xxx, share_name: smb}
+        routers:
+          - {name: sz-01, server_ip: 192.168.10.1, tags: [sz]}
+    同名路由器以后面的来源为准。每次调用都重新读取，修改文件后不需要重启。
+    缺少用户名 / 密码等字段的路由器记录警告后忽略，不影响其他路由器。
+    """
+    cfg = load_smb_env_config()
+    defaults = {
+        "username": cfg["username"],
+        "password": cfg["password"],
+        "share_name": cfg["share_name"],
+        "config_path": cfg["config_path"]
+    }
+    routers = {}
+
+    def add_router(fields: Dict[str, Any], source: str):
+        try:
+            router = RouterConfig(**fields)
+        except ValidationError as e:
+            missing = ", ".join(str(error["loc"][0]) for error in e.errors())
+            logger.warning(f"忽略路由器 {fields.get('name')}（来自 {source}）: 配置不完整或无效: {missing}")
+            return
+        routers[router.name] = router
+
+    if cfg["server_ip"]:
+        add_router({**defaults, "name": "default", "server_ip": cfg["server_ip"]}, "SERVER_IP")
+    for item in filter(None, (part.strip() for part in os.getenv("ROUTERS", "").split(","))):
+        name, _, server_ip = item.partition("=")
+        if not server_ip:
+            name, server_ip = item, item
+        add_router({**defaults, "name": name, "server_ip": server_ip}, "ROUTERS")
+
+    routers_file = os.getenv("ROUTERS_FILE", "routers.yaml")
+    if os.path.exists(routers_file):
+        # 只有使用路由器列表文件时才需要 PyYAML
+        import yaml
+        with open(routers_file, "r", encoding="utf-8") as f:
+            data = yaml.safe_load(f) or {}
+        file_defaults = {**defaults, **(data.get("defaults") or {})}
+        for item in data.get("routers") or []:
+            add_router({**file_defaults, **item}, routers_file)
+    return routers
+
 def build_smb_path(server_ip: str, share_name: str, config_path: str) -> str:
     norm_path = config_path.replace("/", "\\")
     return f"\\\\{server_ip}\\{share_name}{norm_path}"
 
+def unquote_name(name: str) -> str:
+    # 配置段名称统一去掉两侧引号后再比较（文件里是 'name'，接口参数可能带也可能不带引号）
+    return name.strip("'\"") if name else name
+
+# 写入前发现文件被其他人修改时，重新读取并重放修改的最大次数
+CONFIG_WRITE_RETRIES = 3
+# SMB 会话池：空闲会话的保活间隔和过期时间（秒）
+SMB_KEEPALIVE_INTERVAL = int(os.getenv("SMB_KEEPALIVE_INTERVAL", "30"))
+SMB_IDLE_TIMEOUT = int(os.getenv("SMB_IDLE_TIMEOUT", "300"))
+# 多路由器并发修改的默认并发数
+FANOUT_PARALLELISM = int(os.getenv("FANOUT_PARALLELISM", "8"))
+
+# ------------------- SMB 会话池 -------------------
+class PooledSMBSession:
+    def __init__(self, password_digest: bytes):
+        self.password_digest = password_digest
+        # 每个会话使用独立的连接缓存，不和 smbclient 的全局连接池混用
+        self.connection_cache = {}
+        self.last_used = time.time()
+        self.in_use = 0
+        # 已从会话池移除，最后一个使用者归还时关闭
+        self.retired = False
+
+    def connected(self) -> bool:
+        return any(conn.transport.connected for conn in self.connection_cache.values())
+
+    def close(self):
+        for conn in self.connection_cache.values():
+            try:
+                conn.disconnect()
+            except Exception as e:
+                logger.warning(f"关闭 SMB 连接失败: {e}")
+        self.connection_cache.clear()
+
+class SMBSessionPool:
+    """
+    进程内的 SMB 会话池，按 (server_ip, username, share_name) 复用已经认证的连接，
+    避免每个请求都重新协商和认证。断开的连接在下次借用时自动重连，
+    keepalive() 定期给空闲连接发送 echo，超过 SMB_IDLE_TIMEOUT 未使用的连接会被关闭。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions: Dict[tuple, PooledSMBSession] = {}
+
+    @contextlib.contextmanager
+    def session(self, server_ip: str, username: str, password: str, share_name: str):
+        key = (server_ip, username, share_name)
+        password_digest = hashlib.sha256(password.encode("utf-8")).digest()
+        stale = None
+        with self.lock:
+            pooled = self.sessions.get(key)
+            # 密码变化时不能复用旧的认证会话
+            if pooled is not None and not hmac.compare_digest(pooled.password_digest, password_digest):
+                if self._retire(key, pooled):
+                    stale = pooled
+                pooled = None
+            if pooled is None:
+                pooled = self.sessions[key] = PooledSMBSession(password_digest)
+            pooled.in_use += 1
+        if stale is not None:
+            stale.close()
+        try:
+            if not pooled.connected():
+                logger.info(f"建立 SMB 会话: {server_ip} ({username})")
+                pooled.connection_cache.clear()
+                smbclient.register_session(server_ip, username=username, password=password,
+                                           connection_cache=pooled.connection_cache)
+            yield pooled
+        except (SMBConnectionClosed, ConnectionError):
+            # 连接已断开，丢弃该会话，下次借用时重新连接
+            self.discard(key, pooled)
+            raise
+        finally:
+            self._release(pooled)
+
+    def _retire(self, key: tuple, pooled: PooledSMBSession) -> bool:
+        # 调用方需持有 self.lock；返回 True 表示已没有使用者，可以立即关闭
+        if self.sessions.get(key) is pooled:
+            del self.sessions[key]
+        pooled.retired = True
+        return pooled.in_use == 0
+
+    def _release(self, pooled: PooledSMBSession, touch: bool = True):
+        with self.lock:
+            pooled.in_use -= 1
+            if touch:
+                pooled.last_used = time.time()
+            close_now = pooled.retired and pooled.in_use == 0
+        if close_now:
+            pooled.close()
+
+    def discard(self, key: tuple, pooled: PooledSMBSession):
+        # 仍有其他请求在使用时只从池中移除，由最后一个使用者归还时关闭
+        with self.lock:
+            close_now = self._retire(key, pooled)
+        if close_now:
+            pooled.close()
+
+    def keepalive(self):
+        now = time.time()
+        expired, probes = [], []
+        # 过期判断和移除在同一次加锁内完成；需要保活的会话先占用（in_use + 1），
+        # 发送 echo 期间不会被判定为空闲，也不会被其他线程关闭
+        with self.lock:
+            for key, pooled in list(self.sessions.items()):
+                if pooled.in_use:
+                    continue
+                if now - pooled.last_used > SMB_IDLE_TIMEOUT:
+                    self._retire(key, pooled)
+                    expired.append((key, pooled))
+                else:
+                    pooled.in_use += 1
+                    probes.append((key, pooled))
+        for key, pooled in expired:
+            logger.info(f"关闭空闲的 SMB 会话: {key[0]} ({key[1]})")
+            pooled.close()
+        for key, pooled in probes:
+            try:
+                for conn in pooled.connection_cache.values():
+                    conn.echo(timeout=10)
+            except Exception as e:
+                logger.warning(f"SMB 会话保活失败，下次使用时重连: {key[0]}: {e}")
+                self.discard(key, pooled)
+            finally:
+                # 保活不算使用，不刷新 last_used
+                self._release(pooled, touch=False)
+
+    def close_all(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for pooled in sessions:
+            pooled.close()
+
+smb_pool = SMBSessionPool()
+
+def smb_read_text(path: str, **kwargs) -> str:
+    with open_file(path, mode='r', encoding='utf-8', **kwargs) as f:
+        return f.read()
+
+def smb_write_text(path: str, content: str, **kwargs):
+    with open_file(path, mode='w', encoding='utf-8', **kwargs) as f:
+        f.write(content)
+
 # ------------------- 数据模型 -------------------
 class SMBConfig(BaseModel):
     server_ip: str
@@ -43,10 +247,16 @@ class SMBConfig(BaseModel):
     password: str
     share_name: str = "smb"
 
+class RouterConfig(SMBConfig):
+    name: str
+    config_path: str = "/etc/config/passwall"
+    tags: List[str] = []
+
 class ConfigSection(BaseModel):
     type: str
     name: str
     options: Dict[str, str]
+    lists: Dict[str, List[str]] = {}
 
 class AddSectionFullRequest(BaseModel):
     smb_config: SMBConfig
@@ -74,7 +284,301 @@ class AddNodeRequest(BaseModel):
     port: str
     password: str
 
+class BatchOperation(BaseModel):
+    # op: add_section / update_section / delete_section / add_node，其余字段与对应的单个接口相同
+    op: str
+    section: ConfigSection = None
+    shunt_node_name: str = None
+    shunt_option_suffix: str = None
+    shunt_proxy_node: str = None
+    section_type: str = None
+    section_name: str = None
+    updated_options: dict = None
+    name: str = None
+    remarks: str = None
+    address: str = None
+    port: str = None
+    password: str = None
+
+class BatchRequest(BaseModel):
+    smb_config: SMBConfig
+    operations: List[BatchOperation]
+
+class FanoutRequest(BaseModel):
+    # routers 为路由器名称列表（["*"] 表示全部），tags 按标签选择，两者取并集
+    routers: List[str] = []
+    tags: List[str] = []
+    operations: List[BatchOperation]
+    dry_run: bool = False
+    parallelism: int = None
+
+# ------------------- UCI 文档模型 -------------------
+# 常见的 option / list 行：option key 'value'，一行一个正则匹配，其他写法（转义、拼接）退回 shlex
+_UCI_OPTION_RE = re.compile(r"^\s*(option|list)\s+(\S+)\s+'([^']*)'\s*$")
+_UCI_LINE_RE = re.compile(r"^\s*(config|option|list)(?:\s+(\S+))?(?:\s+(.*?))?\s*$")
+_UCI_SIMPLE_VALUE_RE = re.compile(r"^'([^']*)'$|^\"([^\"\\$`]*)\"$|^([^'\"\\\s#]*)$")
+
+def uci_unquote(value: str) -> str:
+    if value is None:
+        return ""
+    match = _UCI_SIMPLE_VALUE_RE.match(value)
+    if match:
+        return next(group for group in match.groups() if group is not None)
+    # 'it'\''s' 这类拼接写法按 shell 规则解析，多个片段拼成一个值
+    return "".join(shlex.split(value, comments=True))
+
+def uci_quote(value: str) -> str:
+    # UCI 单引号内不能转义，单引号写成 '\''
+    return "'" + value.replace("'", "'\\''") + "'"
+
+def parse_uci_line(line: str) -> tuple:
+    """解析段内的一行，返回 (类型, key, 值)，类型为 option / list / comment（空行、注释和无法识别的行）"""
+    match = _UCI_OPTION_RE.match(line)
+    if match:
+        return match.groups()
+    match = _UCI_LINE_RE.match(line)
+    if match and match.group(1) != "config" and match.group(2) and not line.lstrip().startswith("#"):
+        return match.group(1), match.group(2), uci_unquote(match.group(3))
+    return "comment", None, None
+
+class UciSection:
+    """
+    一个 config 段。options 是普通选项，lists 是 list 选项（同一个 key 多个值），两者都保持原有顺序。
+    从文件解析出的段只保存原始文本（header、body），第一次访问 options / lists 时才解析，
+    大部分段在一次修改中不会被访问。
+    修改请使用 set_option / update_options / set_list 等方法，它们会把段标记为 dirty，
+    序列化时只有 dirty 的段会重新生成，其他段原样输出。
+    """
+    __slots__ = ("type", "name", "leading", "header", "body", "_options", "_lists", "dirty")
+
+    def __init__(self, type: str, name: str = "", options: Dict[str, str] = None,
+                 lists: Dict[str, List[str]] = None):
+        self.type = type
+        self.name = name
+        self.leading = []
+        self.header = None
+        self.body = ""
+        self._options = dict(options or {})
+        self._lists = {key: list(values) for key, values in (lists or {}).items()}
+        self.dirty = True
+
+    @classmethod
+    def from_text(cls, section_type: str, name: str, header: str, body: str, leading: List[str]) -> "UciSection":
+        section = cls.__new__(cls)
+        section.type = section_type
+        section.name = name
+        section.leading = leading
+        section.header = header
+        section.body = body
+        section._options = None
+        section._lists = None
+        section.dirty = False
+        return section
+
+    def _entries(self):
+        for line in self.body.splitlines(keepends=True):
+            yield parse_uci_line(line) + (line,)
+
+    def _load(self):
+        options, lists = {}, {}
+        for kind, key, value, _ in self._entries():
+            if kind == "option":
+                options[key] = value
+            elif kind == "list":
+                lists.setdefault(key, []).append(value)
+        self._options, self._lists = options, lists
+
+    @property
+    def options(self) -> Dict[str, str]:
+        if self._options is None:
+            self._load()
+        return self._options
+
+    @property
+    def lists(self) -> Dict[str, List[str]]:
+        if self._lists is None:
+            self._load()
+        return self._lists
+
+    def set_option(self, key: str, value: str):
+        if self.options.get(key) != value:
+            self.options[key] = value
+            self.dirty = True
+
+    def update_options(self, options: Dict[str, str]):
+        for key, value in options.items():
+            self.set_option(key, value)
+
+    def delete_option(self, key: str):
+        if self.options.pop(key, None) is not None:
+            self.dirty = True
+
+    def set_list(self, key: str, values: List[str]):
+        if self.lists.get(key) != list(values):
+            self.lists[key] = list(values)
+            self.dirty = True
+
+    def to_model(self) -> ConfigSection:
+        return ConfigSection(type=self.type, name=self.name, options=dict(self.options),
+                             lists={key: list(values) for key, values in self.lists.items()})
+
+    def render(self) -> List[str]:
+        lines = list(self.leading)
+        if not self.dirty:
+            lines.append(self.header)
+            lines.append(self.body)
+            return lines
+
+        lines.append(self.header or (f"config {self.type} {uci_quote(self.name)}\n" if self.name else f"config {self.type}\n"))
+        entries = list(self._entries())
+        original_lists = {}
+        for kind, key, value, raw in entries:
+            if kind == "list":
+                original_lists.setdefault(key, []).append((value, raw))
+        seen_options, seen_lists = set(), set()
+        for kind, key, value, raw in entries:
+            if kind == "option":
+                seen_options.add(key)
+                if key in self.options:
+                    # 值没变的行保留原来的写法（引号等）
+                    lines.append(raw if self.options[key] == value else f"\toption {key} {uci_quote(self.options[key])}\n")
+            elif kind == "list":
+                if key in seen_lists:
+                    continue
+                seen_lists.add(key)
+                current = self.lists.get(key, [])
+                if current == [item[0] for item in original_lists[key]]:
+                    lines.extend(item[1] for item in original_lists[key])
+                else:
+                    lines.extend(f"\tlist {key} {uci_quote(item)}\n" for item in current)
+            else:
+                lines.append(raw)
+        # 新增的选项追加在段末尾
+        lines.extend(f"\toption {key} {uci_quote(value)}\n" for key, value in self.options.items() if key not in seen_options)
+        for key, values in self.lists.items():
+            if key not in seen_lists:
+                lines.extend(f"\tlist {key} {uci_quote(item)}\n" for item in values)
+        return lines
+
+class UciDocument:
+    """
+    UCI 配置文件的文档模型：保持段的顺序、注释和原始写法，按 (type, name) 建立索引。
+    同一个 (type, name) 可能出现多次（手工编辑或旧版本重复写入），索引保存全部匹配的段，
+    get() 返回第一个，get_all() / remove() 作用于全部。
+    未修改的文档序列化后与原文完全一致，修改后只有变化的段会重新生成。
+    """
+    __slots__ = ("preamble", "sections", "index", "trailer", "missing_final_newline")
+
+    def __init__(self):
+        self.preamble = []
+        self.sections: List[UciSection] = []
+        self.index: Dict[tuple, List[UciSection]] = {}
+        self.trailer = []
+        self.missing_final_newline = False
+
+    @classmethod
+    def parse(cls, content: str) -> "UciDocument":
+        doc = cls()
+        lines = content.splitlines(keepends=True)
+        if lines and not lines[-1].endswith("\n"):
+            lines[-1] += "\n"
+            doc.missing_final_newline = True
+        # 段之间的空行和注释归到下一个段前面（删除段时一起删除它的注释）
+        pending = []
+        header, section_type, name, leading, body = None, None, None, None, []
+        for line in lines:
+            stripped = line.lstrip()
+            if not stripped or stripped[0] == "#":
+                pending.append(line)
+            elif stripped.startswith("config") and stripped[6:7].isspace():
+                match = _UCI_LINE_RE.match(line)
+                if header is None:
+                    doc.preamble = pending
+                else:
+                    doc._append(UciSection.from_text(section_type, name, header, "".join(body), leading))
+                header, leading, body, pending = line, pending if header is not None else [], [], []
+                section_type = match.group(2) or ""
+                name = uci_unquote(match.group(3)) if match.group(3) else ""
+            elif header is not None:
+                if pending:
+                    body.extend(pending)
+                    pending = []
+                body.append(line)
+            else:
+                pending.append(line)
+        if header is None:
+            doc.preamble = pending
+        else:
+            doc._append(UciSection.from_text(section_type, name, header, "".join(body), leading))
+            doc.trailer = pending
+        return doc
+
+    def _append(self, section: UciSection):
+        self.sections.append(section)
+        if section.name:
+            self.index.setdefault((section.type, section.name), []).append(section)
+
+    def get(self, section_type: str, name: str) -> UciSection:
+        matches = self.index.get((section_type, name))
+        return matches[0] if matches else None
+
+    def get_all(self, section_type: str, name: str) -> List[UciSection]:
+        return list(self.index.get((section_type, name), []))
+
+    def add(self, section: UciSection) -> UciSection:
+        if self.sections or self.preamble:
+            section.leading = ["\n"]
+        section.dirty = True
+        self._append(section)
+        return section
+
+    def remove(self, section_type: str, name: str) -> List[UciSection]:
+        """删除全部匹配的段，返回被删除的段（没有匹配时为空列表）"""
+        removed = self.index.pop((section_type, name), [])
+        if removed:
+            removed_ids = {id(section) for section in removed}
+            self.sections = [section for section in self.sections if id(section) not in removed_ids]
+        return removed
+
+    def serialize(self) -> str:
+        lines = list(self.preamble)
+        for section in self.sections:
+            lines.extend(section.render())
+        lines.extend(self.trailer)
+        content = "".join(lines)
+        if self.missing_final_newline and content.endswith("\n"):
+            content = content[:-1]
+        return content
+
 # ------------------- 核心类 -------------------
+class RouterConfigState:
+    """
+    单个路由器配置文件的缓存和锁：document 是解析后的 UCI 文档，version 是读取时文件的 (mtime, size)。
+    同一个路由器的修改通过 lock 串行执行。lock 是 asyncio.Lock，在事件循环中排队，
+    拿到锁之后才把 SMB 读写交给线程池，等待中的请求不会占用线程池的线程。
+    """
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.document = None
+        self.version = None
+
+    def invalidate(self):
+        self.document = None
+        self.version = None
+
+_router_states: Dict[str, RouterConfigState] = {}
+_router_states_lock = threading.Lock()
+
+def get_router_state(smb_path: str) -> RouterConfigState:
+    with _router_states_lock:
+        state = _router_states.get(smb_path)
+        if state is None:
+            state = _router_states[smb_path] = RouterConfigState()
+        return state
+
+class ConfigConflictError(Exception):
+    pass
+
 class PassWallConfigManager:
     def __init__(self, server_ip: str, username: str, password: str, share_name: str, config_path: str):
         self.server_ip = server_ip
@@ -83,65 +587,139 @@ class PassWallConfigManager:
         self.share_name = share_name
         self.config_path = config_path
         self.smb_path = build_smb_path(server_ip, share_name, config_path)
-        smbclient.register_session(server_ip, username=username, password=password)
+
+    def smb_call(self, func: Callable, *args, **kwargs):
+        """从会话池借用会话执行 smbclient 调用，连接断开时重连后重试一次"""
+        for attempt in range(2):
+            try:
+                with smb_pool.session(self.server_ip, self.username, self.password, self.share_name) as pooled:
+                    return func(*args, username=self.username, password=self.password,
+                                connection_cache=pooled.connection_cache, **kwargs)
+            except (SMBConnectionClosed, ConnectionError):
+                if attempt:
+                    raise
+                logger.warning(f"SMB 连接已断开，重新连接: {self.server_ip}")
 
     def read_config(self) -> str:
         try:
-            with open_file(self.smb_path, mode='r', encoding='utf-8') as f:
-                return f.read()
+            return self.smb_call(smb_read_text, self.smb_path)
         except Exception as e:
             logger.error(f"读取失败: {e}")
             raise HTTPException(status_code=500, detail=f"读取失败: {str(e)}")
 
     def write_config(self, content: str) -> bool:
         try:
-            with open_file(self.smb_path, mode='w', encoding='utf-8') as f:
-                f.write(content)
+            self.smb_call(smb_write_text, self.smb_path, content)
             return True
         except Exception as e:
             logger.error(f"写入失败: {e}")
             raise HTTPException(status_code=500, detail=f"写入失败: {str(e)}")
 
-    def parse_config(self, content: str) -> List[Dict]:
-        sections = []
-        current_section = None
-        lines = content.strip().split('\n')
-        for line in lines:
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-            if line.startswith('config '):
-                if current_section:
-                    sections.append(current_section)
-                parts = line.split()
-                current_section = {
-                    'type': parts[1],
-                    'name': parts[2] if len(parts) >= 3 else '',
-                    'options': {}
-                }
-            elif line.startswith('option ') and current_section:
-                match = re.match(r"option\s+(\w+)\s+(.+)", line)
-                if match:
-                    key, value = match.groups()
-                    value = value.strip("'\"")
-                    current_section['options'][key] = value
-        if current_section:
-            sections.append(current_section)
-        return sections
-
-    def format_config(self, sections: List[Any]) -> str:
-        lines = []
-        for section in sections:
-            lines.append("")
-            # 使用 . 访问属性
-            if section.name:
-                lines.append(f"config {section.type} '{section.name}'")
-            else:
-                lines.append(f"config {section.type}")
-            for key, value in section.options.items():
-                escaped = value.replace("'", "\\'") if any(c in value for c in " ' \"") else value
-                lines.append(f"\toption {key} '{escaped}'")
-        return '\n'.join(lines).strip()
+    def stat_config(self) -> tuple:
+        """返回配置文件当前的版本 (mtime, size)，用于判断缓存是否有效以及写入前的比较"""
+        try:
+            st = self.smb_call(smbclient.stat, self.smb_path)
+            return st.st_mtime, st.st_size
+        except Exception as e:
+            logger.error(f"读取文件信息失败: {e}")
+            raise HTTPException(status_code=500, detail=f"读取文件信息失败: {str(e)}")
+
+    def load_document(self, state: RouterConfigState) -> UciDocument:
+        """文件版本与缓存一致时直接使用缓存的解析结果，否则重新读取并解析"""
+        version = self.stat_config()
+        if state.document is None or state.version != version:
+            logger.info(f"配置缓存失效，重新读取: {self.smb_path}")
+            state.document = UciDocument.parse(self.read_config())
+            state.version = version
+        return state.document
+
+    async def apply(self, mutations: List[Callable[[UciDocument], Any]]) -> List[Any]:
+        """
+        在同一个路由器锁内依次执行 mutations（每个函数就地修改 UCI 文档并返回结果），最后只写一次文件。
+        写入前再次检查文件版本，如果读取之后文件被其他人修改，则重新读取并重放全部修改；
+        任何一步失败都不写入，并丢弃缓存。
+        """
+        return await self._run_locked(self._apply_locked, mutations)
+
+    async def _run_locked(self, func: Callable, *args):
+        """持有路由器的 asyncio.Lock，在线程池中执行 func(state, *args)"""
+        state = get_router_state(self.smb_path)
+        async with state.lock:
+            task = asyncio.ensure_future(asyncio.to_thread(func, state, *args))
+            try:
+                return await asyncio.shield(task)
+            except asyncio.CancelledError:
+                # 请求被取消时线程仍在读写配置文件，等它结束后再释放锁
+                await asyncio.wait([task])
+                raise
+
+    def _apply_locked(self, state: RouterConfigState, mutations: List[Callable[[UciDocument], Any]]) -> List[Any]:
+        # 在线程池中执行，调用方已持有 state.lock
+        for attempt in range(CONFIG_WRITE_RETRIES):
+            try:
+                document = self.load_document(state)
+                read_version = state.version
+                results = [mutation(document) for mutation in mutations]
+                new_content = document.serialize()
+                if self.stat_config() != read_version:
+                    raise ConfigConflictError()
+                self.write_config(new_content)
+                state.version = self.stat_config()
+                return results
+            except ConfigConflictError:
+                logger.warning(f"配置文件在读取后被修改，重新读取后重试 ({attempt + 1}/{CONFIG_WRITE_RETRIES}): {self.smb_path}")
+                state.invalidate()
+            except Exception:
+                state.invalidate()
+                raise
+        raise HTTPException(status_code=409, detail="配置文件被并发修改，请稍后重试")
+
+    async def preview(self, mutations: List[Callable[[UciDocument], Any]]) -> tuple:
+        """
+        在配置副本上执行 mutations，不写入文件，返回 (结果列表, unified diff)。
+        """
+        original = await self._run_locked(self._snapshot_locked)
+        return await asyncio.to_thread(self._diff, original, mutations)
+
+    def _snapshot_locked(self, state: RouterConfigState) -> str:
+        try:
+            return self.load_document(state).serialize()
+        except Exception:
+            state.invalidate()
+            raise
+
+    def _diff(self, original: str, mutations: List[Callable[[UciDocument], Any]]) -> tuple:
+        document = UciDocument.parse(original)
+        results = [mutation(document) for mutation in mutations]
+        diff = "".join(difflib.unified_diff(
+            original.splitlines(keepends=True),
+            document.serialize().splitlines(keepends=True),
+            fromfile=f"a{self.config_path}",
+            tofile=f"b{self.config_path}"
+        ))
+        return results, diff
+
+# ------------------- 生命周期 -------------------
+_smb_keepalive_task = None
+
+async def _smb_keepalive_loop():
+    while True:
+        await asyncio.sleep(SMB_KEEPALIVE_INTERVAL)
+        try:
+            await asyncio.to_thread(smb_pool.keepalive)
+        except Exception as e:
+            logger.error(f"SMB 会话保活出错: {e}")
+
+@app.on_event("startup")
+async def startup():
+    global _smb_keepalive_task
+    _smb_keepalive_task = asyncio.ensure_future(_smb_keepalive_loop())
+
+@app.on_event("shutdown")
+async def shutdown():
+    if _smb_keepalive_task is not None:
+        _smb_keepalive_task.cancel()
+    await asyncio.to_thread(smb_pool.close_all)
 
 # ------------------- 接口 -------------------
 @app.get("/")
@@ -155,7 +733,7 @@ async def read_config():
     if not cfg["server_ip"] or not cfg["username"] or not cfg["password"]:
         raise HTTPException(status_code=400, detail="缺少必要环境变量")
     manager = PassWallConfigManager(cfg["server_ip"], cfg["username"], cfg["password"], cfg["share_name"], cfg["config_path"])
-    content = manager.read_config()
+    content = await asyncio.to_thread(manager.read_config)
     return {"success": 'success', "code": 200, "data": content}
 
 # 添加配置段(往配置文件后面添加)
@@ -207,46 +785,125 @@ async def read_config():
   "shunt_proxy_node": "Dah2TR22"
 }
 '''
-@app.post("/config/add-section")
-async def add_section(payload: AddSectionFullRequest):
-    smb_config = payload.smb_config
-    section = payload.section
-    shunt_node_name = payload.shunt_node_name
-    shunt_option_suffix = payload.shunt_option_suffix
-    shunt_proxy_node = payload.shunt_proxy_node
+def add_section_op(section: ConfigSection, shunt_node_name: str = None,
+                   shunt_option_suffix: str = None, shunt_proxy_node: str = None) -> Callable:
+    def mutate(document: UciDocument):
+        document.add(UciSection(section.type, unquote_name(section.name), section.options, section.lists))
+
+        if shunt_node_name and shunt_option_suffix and shunt_proxy_node:
+            shunt_node = document.get("nodes", unquote_name(shunt_node_name))
+            if shunt_node is not None:
+                logger.info(f"添加 shunt 选项到 section: {shunt_node.name}")
+                shunt_node.set_option(f"fenliu_{shunt_option_suffix}", shunt_proxy_node)
+                shunt_node.set_option(f"fenliu_{shunt_option_suffix}_proxy_tag", "main")
+        return section
+    return mutate
+
+def delete_section_op(section_type: str, section_name: str) -> Callable:
+    def mutate(document: UciDocument):
+        # 删除指定 section
+        if not document.remove(section_type, unquote_name(section_name)):
+            raise HTTPException(status_code=404, detail="未找到要删除的配置段")
+    return mutate
+
+def update_section_op(section_type: str, section_name: str, updated_options: dict) -> Callable:
+    def mutate(document: UciDocument):
+        sections = document.get_all(section_type, unquote_name(section_name))
+        if not sections:
+            raise HTTPException(status_code=404, detail="未找到要修改的配置段")
+        # 同名的段全部更新，和删除保持一致
+        for section in sections:
+            logger.info(f"正在更新 section: {section.name}")
+            section.update_options(updated_options)
+        return updated_options
+    return mutate
+
+def add_node_op(node_section: ConfigSection) -> Callable:
+    def mutate(document: UciDocument):
+        # 先检查是否已有同名节点，避免重复；名称和 add_section 一样去掉两侧引号
+        name = unquote_name(node_section.name)
+        if document.get("nodes", name) is not None:
+            raise HTTPException(status_code=400, detail=f"节点名 '{name}' 已存在")
+        document.add(UciSection(node_section.type, name, node_section.options, node_section.lists))
+        return node_section
+    return mutate
 
-    manager = PassWallConfigManager(
+def build_node_section(name: str, remarks: str, address: str, port: str, password: str) -> ConfigSection:
+    return ConfigSection(
+        type="nodes",
+        name=name,
+        options={
+            "remarks": remarks,
+            "type": "Xray",
+            "protocol": "trojan",
+            "address": address,
+            "port": port,
+            "password": password,
+            "tls": "0",
+            "transport": "raw",
+            "tcp_guise": "none",
+            "tcpMptcp": "0",
+            "tcpNoDelay": "0"
+        }
+    )
+
+# 每种批量操作需要的字段
+BATCH_REQUIRED_FIELDS = {
+    "add_section": ("section",),
+    "update_section": ("section_type", "section_name", "updated_options"),
+    "delete_section": ("section_type", "section_name"),
+    "add_node": ("name", "remarks", "address", "port", "password"),
+}
+
+def build_batch_op(index: int, operation: BatchOperation) -> Callable:
+    """把批量请求中的一个操作转换为修改函数，失败时在错误信息中带上操作序号"""
+    if operation.op not in BATCH_REQUIRED_FIELDS:
+        raise HTTPException(status_code=400, detail=f"第 {index} 个操作类型不支持: {operation.op}")
+    missing = [field for field in BATCH_REQUIRED_FIELDS[operation.op] if getattr(operation, field) is None]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"第 {index} 个操作 {operation.op} 缺少字段: {', '.join(missing)}")
+
+    if operation.op == "add_section":
+        mutate = add_section_op(operation.section, operation.shunt_node_name,
+                                operation.shunt_option_suffix, operation.shunt_proxy_node)
+    elif operation.op == "update_section":
+        mutate = update_section_op(operation.section_type, operation.section_name, operation.updated_options)
+    elif operation.op == "delete_section":
+        mutate = delete_section_op(operation.section_type, operation.section_name)
+    else:
+        mutate = add_node_op(build_node_section(
+            operation.name, operation.remarks, operation.address, operation.port, operation.password))
+
+    def indexed(document: UciDocument):
+        try:
+            return mutate(document)
+        except HTTPException as e:
+            raise HTTPException(status_code=e.status_code, detail=f"第 {index} 个操作 {operation.op} 失败: {e.detail}")
+    return indexed
+
+def get_manager(smb_config: SMBConfig) -> PassWallConfigManager:
+    return PassWallConfigManager(
         smb_config.server_ip,
         smb_config.username,
         smb_config.password,
         smb_config.share_name,
-        "/etc/config/passwall"
+        getattr(smb_config, "config_path", "/etc/config/passwall")
     )
 
-    content = manager.read_config()
-    sections = manager.parse_config(content)
-    sections = [ConfigSection(**s) if isinstance(s, dict) else s for s in sections]
-    sections.append(section)
-
-    if shunt_node_name and shunt_option_suffix and shunt_proxy_node:
-        print("[调试] 命中目标 section，正在修改 options1")
-        for idx, sec in enumerate(sections):
-            print(f"[调试] 当前 section: {sec.name}, type: {sec.type}")
-            if sec.type == "nodes" and sec.name == shunt_node_name:
-                print("[调试] 命中目标 section，正在修改 options")
-                logger.info(f"添加 shunt 选项到 section: {sec.name}")
-                sec.options[f"fenliu_{shunt_option_suffix}"] = shunt_proxy_node
-                sec.options[f"fenliu_{shunt_option_suffix}_proxy_tag"] = "main"
-                sections[idx] = sec
-                break
-
-    new_content = manager.format_config(sections)
-    manager.write_config(new_content)
+@app.post("/config/add-section")
+async def add_section(payload: AddSectionFullRequest):
+    manager = get_manager(payload.smb_config)
+    await manager.apply([add_section_op(
+        payload.section,
+        payload.shunt_node_name,
+        payload.shunt_option_suffix,
+        payload.shunt_proxy_node
+    )])
 
     return {
         "success": 'success',
         "message": "配置段添加成功",
-        "section": section
+        "section": payload.section
     }
 
 # 删除配置段
@@ -265,33 +922,11 @@ async def add_section(payload: AddSectionFullRequest):
 '''
 @app.post("/config/delete-section")
 async def delete_section(payload: DeleteSectionRequest):
-    smb_config = payload.smb_config
     section_type = payload.section_type
     section_name = payload.section_name
 
-    manager = PassWallConfigManager(
-        smb_config.server_ip,
-        smb_config.username,
-        smb_config.password,
-        smb_config.share_name,
-        "/etc/config/passwall"
-    )
-
-    content = manager.read_config()
-    sections = manager.parse_config(content)
-    original_count = len(sections)
-
-    # 删除指定 section
-    sections = [
-        s for s in sections
-        if not (s["type"] == section_type and s["name"] == section_name)
-    ]
-
-    if len(sections) == original_count:
-        raise HTTPException(status_code=404, detail="未找到要删除的配置段")
-
-    new_content = manager.format_config([ConfigSection(**s) for s in sections])
-    manager.write_config(new_content)
+    manager = get_manager(payload.smb_config)
+    await manager.apply([delete_section_op(section_type, section_name)])
 
     return {
         "success": "success",
@@ -334,40 +969,12 @@ async def delete_section(payload: DeleteSectionRequest):
 '''
 @app.post("/config/update-section")
 async def update_section(payload: UpdateSectionRequest):
-    smb_config = payload.smb_config
     section_type = payload.section_type
     section_name = payload.section_name.strip("'\"")  # 去除多余引号
     updated_options = payload.updated_options
 
-    manager = PassWallConfigManager(
-        smb_config.server_ip,
-        smb_config.username,
-        smb_config.password,
-        smb_config.share_name,
-        "/etc/config/passwall"
-    )
-
-    content = manager.read_config()
-    sections = manager.parse_config(content)
-
-    updated_sections = []
-    found = False
-
-    for section_dict in sections:
-        section = ConfigSection(**section_dict) if isinstance(section_dict, dict) else section_dict
-        print(f"[调试] 当前 section: {section.name}, type: {section.type},section_type: {section_type}, section_name: {section_name}")
-        if section.type == section_type and section.name == section_name:
-            logger.info(f"正在更新 section: {section.name}")
-            section.options.update(updated_options)
-            found = True
-
-        updated_sections.append(section)
-
-    if not found:
-        raise HTTPException(status_code=404, detail="未找到要修改的配置段")
-
-    new_content = manager.format_config(updated_sections)
-    manager.write_config(new_content)
+    manager = get_manager(payload.smb_config)
+    await manager.apply([update_section_op(section_type, section_name, updated_options)])
 
     return {
         "success": "success",
@@ -377,52 +984,121 @@ async def update_section(payload: UpdateSectionRequest):
 
 @app.post("/config/add-node")
 async def add_node(payload: AddNodeRequest):
-    smb_config = payload.smb_config
-
-    node_section = ConfigSection(
-        type="nodes",
-        name=payload.name,
-        options={
-            "remarks": payload.remarks,
-            "type": "Xray",
-            "protocol": "trojan",
-            "address": payload.address,
-            "port": payload.port,
-            "password": payload.password,
-            "tls": "0",
-            "transport": "raw",
-            "tcp_guise": "none",
-            "tcpMptcp": "0",
-            "tcpNoDelay": "0"
-        }
-    )
+    node_section = build_node_section(payload.name, payload.remarks, payload.address, payload.port, payload.password)
 
-    manager = PassWallConfigManager(
-        smb_config.server_ip,
-        smb_config.username,
-        smb_config.password,
-        smb_config.share_name,
-        "/etc/config/passwall"
-    )
+    manager = get_manager(payload.smb_config)
+    await manager.apply([add_node_op(node_section)])
 
-    content = manager.read_config()
-    sections = manager.parse_config(content)
-    sections = [ConfigSection(**s) if isinstance(s, dict) else s for s in sections]
+    return {
+        "success": "success",
+        "message": f"节点 '{node_section.name}' 添加成功",
+        "node": node_section
+    }
 
-    # 先检查是否已有同名节点，避免重复
-    for sec in sections:
-        if sec.type == "nodes" and sec.name == node_section.name:
-            raise HTTPException(status_code=400, detail=f"节点名 '{node_section.name}' 已存在")
+# 批量修改：按顺序应用所有操作，只读写一次配置文件，任何一个操作失败则全部不生效
+'''
+    测试raw
+    {
+  "smb_config": {
+    "server_ip": "192.168.10.1",
+    "username": "root",
+    "password": "redao2024",
+    "share_name": "smb"
+  },
+  "operations": [
+    {"op": "add_node", "name": "Dah2TR22", "remarks": "socks_23", "address": "1.2.3.4", "port": "1080", "password": "xxx"},
+    {"op": "add_section", "section": {"type": "shunt_rules", "name": "fenliu_23", "options": {"remarks": "fenliu_23", "network": "tcp,udp", "source": "192.168.10.23", "ip_list": "0.0.0.0/0"}},
+     "shunt_node_name": "UbdghGyO", "shunt_option_suffix": "23", "shunt_proxy_node": "Dah2TR22"},
+    {"op": "update_section", "section_type": "nodes", "section_name": "UbdghGyO", "updated_options": {"fenliu_23": "Dah2TR22"}},
+    {"op": "delete_section", "section_type": "shunt_rules", "section_name": "fenliu_old"}
+  ]
+}
+'''
+@app.post("/config/batch")
+async def batch_config(payload: BatchRequest):
+    if not payload.operations:
+        raise HTTPException(status_code=400, detail="operations 不能为空")
+    mutations = [build_batch_op(index, operation) for index, operation in enumerate(payload.operations)]
 
-    sections.append(node_section)
+    manager = get_manager(payload.smb_config)
+    results = await manager.apply(mutations)
 
-    new_content = manager.format_config(sections)
-    manager.write_config(new_content)
+    return {
+        "success": "success",
+        "message": f"已应用 {len(mutations)} 个操作",
+        "results": [{"op": operation.op, "result": result} for operation, result in zip(payload.operations, results)]
+    }
 
+@app.get("/routers")
+async def list_routers():
+    routers = load_router_registry()
     return {
         "success": "success",
-        "message": f"节点 '{node_section.name}' 添加成功",
-        "node": node_section
+        "routers": [router.model_dump(exclude={"password"}) for router in routers.values()]
+    }
+
+# 多路由器批量修改：对选中的每台路由器并发执行同一组操作，每台路由器单独返回结果
+# dry_run 为 true 时不写入，只返回每台路由器的配置 diff
+'''
+    测试raw
+    {
+  "routers": ["*"],
+  "tags": [],
+  "dry_run": true,
+  "operations": [
+    {"op": "add_node", "name": "Dah2TR22", "remarks": "socks_23", "address": "1.2.3.4", "port": "1080", "password": "xxx"}
+  ]
+}
+'''
+@app.post("/config/fanout")
+async def fanout_config(payload: FanoutRequest):
+    if not payload.operations:
+        raise HTTPException(status_code=400, detail="operations 不能为空")
+    registry = load_router_registry()
+    selected = [
+        router for name, router in registry.items()
+        if "*" in payload.routers or name in payload.routers or set(router.tags) & set(payload.tags)
+    ]
+    unknown = [name for name in payload.routers if name != "*" and name not in registry]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"未知的路由器: {', '.join(unknown)}")
+    if not selected:
+        raise HTTPException(status_code=400, detail="没有选中任何路由器")
+    # 先校验操作，参数有误时不会修改任何路由器
+    for index, operation in enumerate(payload.operations):
+        build_batch_op(index, operation)
+
+    semaphore = asyncio.Semaphore(payload.parallelism or FANOUT_PARALLELISM)
+
+    async def apply_to_router(router: RouterConfig) -> Dict[str, Any]:
+        # 每台路由器使用独立的修改函数，避免共享状态
+        mutations = [build_batch_op(index, operation) for index, operation in enumerate(payload.operations)]
+        manager = get_manager(router)
+        result = {"router": router.name, "server_ip": router.server_ip}
+        try:
+            async with semaphore:
+                if payload.dry_run:
+                    results, diff = await manager.preview(mutations)
+                    result["diff"] = diff
+                else:
+                    results = await manager.apply(mutations)
+            result["success"] = True
+            result["results"] = results
+        except HTTPException as e:
+            result["success"] = False
+            result["error"] = e.detail
+        except Exception as e:
+            logger.error(f"路由器 {router.name} 修改失败: {e}")
+            result["success"] = False
+            result["error"] = str(e)
+        return result
+
+    results = await asyncio.gather(*(apply_to_router(router) for router in selected))
+    failed = sum(1 for result in results if not result["success"])
+    return {
+        "success": "success" if not failed else "partial",
+        "message": f"{len(results) - failed} 台成功，{failed} 台失败" + ("（dry run，未写入）" if payload.dry_run else ""),
+        "results": results
     }
 
 if __name__ == "__main__":
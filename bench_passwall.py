@@ -0,0 +1,211 @@
+"""
+PassWall 配置解析 / 序列化压测：生成 100 ~ 50k 个配置段的合成 /etc/config/passwall，
+对比原来的 parse_config / format_config（扁平字典列表）和 UciDocument 的
+解析、按名称查找、修改、序列化耗时以及峰值内存。
+SMB 用本地文件代替，可以离线运行；最后再通过 PassWallConfigManager.apply 测一次完整的读-改-写。
+
+用法示例:
+    python bench_passwall.py --sizes 100 1000 10000 50000 --lookups 1000
+"""
+import argparse
+import importlib.util
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import smbclient
+
+MODULE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "Modify the engineering batch script of Openwrt's passwall plug-in.py")
+
+
+def load_passwall_module():
+    # 文件名带空格和引号，只能通过 importlib 按路径加载
+    spec = importlib.util.spec_from_file_location("passwall_api", MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# ------------------- 原来的实现（用于对比） -------------------
+def legacy_parse_config(content):
+    sections = []
+    current_section = None
+    lines = content.strip().split('\n')
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('config '):
+            if current_section:
+                sections.append(current_section)
+            parts = line.split()
+            current_section = {
+                'type': parts[1],
+                'name': parts[2] if len(parts) >= 3 else '',
+                'options': {}
+            }
+        elif line.startswith('option ') and current_section:
+            match = re.match(r"option\s+(\w+)\s+(.+)", line)
+            if match:
+                key, value = match.groups()
+                value = value.strip("'\"")
+                current_section['options'][key] = value
+    if current_section:
+        sections.append(current_section)
+    return sections
+
+
+def legacy_format_config(sections):
+    lines = []
+    for section in sections:
+        lines.append("")
+        if section['name']:
+            lines.append(f"config {section['type']} '{section['name']}'")
+        else:
+            lines.append(f"config {section['type']}")
+        for key, value in section['options'].items():
+            escaped = value.replace("'", "\\'") if any(c in value for c in " ' \"") else value
+            lines.append(f"\toption {key} '{escaped}'")
+    return '\n'.join(lines).strip()
+
+
+def legacy_find(sections, section_type, name):
+    for section in sections:
+        if section['type'] == section_type and section['name'] == f"'{name}'":
+            return section
+    return None
+
+
+# ------------------- 合成配置 -------------------
+def generate_config(section_count, seed=0):
+    """
+    生成与线上结构相近的配置：一个 global、一个分流节点，其余一半是 nodes、一半是 shunt_rules。
+    """
+    rng = random.Random(seed)
+    lines = ["", "config global", "\toption enabled '1'", "\toption tcp_node 'UbdghGyO'", "",
+             "config nodes 'UbdghGyO'", "\toption remarks 'shunt'", "\toption protocol '_shunt'"]
+    names = []
+    for i in range(section_count):
+        if i % 2 == 0:
+            name = f"node{i:06d}"
+            lines += ["", f"config nodes '{name}'",
+                      f"\toption remarks 'socks_{i}'", "\toption type 'Xray'", "\toption protocol 'trojan'",
+                      f"\toption address '10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}'",
+                      f"\toption port '{rng.randint(1024, 65535)}'", f"\toption password 'pw{rng.getrandbits(32):08x}'",
+                      "\toption tls '0'", "\toption transport 'raw'"]
+            names.append(("nodes", name))
+        else:
+            name = f"fenliu_{i:06d}"
+            lines += ["", f"config shunt_rules '{name}'", f"\toption remarks '{name}'",
+                      "\toption network 'tcp,udp'", f"\toption source '192.168.{i // 250 % 256}.{i % 250 + 1}'",
+                      "\toption ip_list '0.0.0.0/0'"]
+            names.append(("shunt_rules", name))
+    return "\n".join(lines).strip() + "\n", names
+
+
+def measure(func):
+    """返回 (结果, 耗时秒, 峰值内存字节)"""
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start_time
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def bench_size(pw, section_count, lookups, mutations):
+    content, names = generate_config(section_count)
+    targets = random.Random(1).sample(names, min(lookups, len(names)))
+    updates = targets[:mutations]
+    rows = []
+
+    # 原来的实现
+    sections, parse_time, parse_peak = measure(lambda: legacy_parse_config(content))
+    _, lookup_time, _ = measure(lambda: [legacy_find(sections, t, n) for t, n in targets])
+
+    def legacy_mutate():
+        for section_type, name in updates:
+            legacy_find(sections, section_type, name)['options']['remarks'] = "changed"
+        sections.append({"type": "nodes", "name": "new_node", "options": {"remarks": "new"}})
+    _, mutate_time, _ = measure(legacy_mutate)
+    _, format_time, format_peak = measure(lambda: legacy_format_config(sections))
+    rows.append(("legacy", parse_time, lookup_time, mutate_time, format_time, max(parse_peak, format_peak)))
+
+    # UciDocument
+    document, parse_time, parse_peak = measure(lambda: pw.UciDocument.parse(content))
+    assert document.serialize() == content, "UciDocument 往返结果与原文不一致"
+    _, lookup_time, _ = measure(lambda: [document.get(t, n) for t, n in targets])
+
+    def document_mutate():
+        for section_type, name in updates:
+            document.get(section_type, name).set_option("remarks", "changed")
+        document.add(pw.UciSection("nodes", "new_node", {"remarks": "new"}))
+    _, mutate_time, _ = measure(document_mutate)
+    _, format_time, format_peak = measure(document.serialize)
+    rows.append(("uci", parse_time, lookup_time, mutate_time, format_time, max(parse_peak, format_peak)))
+    return len(content), rows
+
+
+def bench_apply(pw, work_dir, section_count, rounds):
+    """
+    用本地文件代替 SMB，测 PassWallConfigManager.apply 的完整读-改-写（首轮需要解析，之后命中缓存）。
+    """
+    local_path = os.path.join(work_dir, "passwall")
+    with open(local_path, "w", encoding="utf-8") as f:
+        f.write(generate_config(section_count)[0])
+
+    def local_open(path, mode="r", encoding=None, **kwargs):
+        return open(local_path, mode, encoding=encoding)
+
+    pw.open_file = local_open
+    smbclient.stat = lambda path, **kwargs: os.stat(local_path)
+    smbclient.register_session = lambda *args, **kwargs: None
+    pw.PooledSMBSession.connected = lambda self: True
+
+    manager = pw.PassWallConfigManager("127.0.0.1", "bench", "bench", "smb", "/etc/config/passwall")
+    timings = []
+    for i in range(rounds):
+        # 修改间隔至少 10ms，避免文件系统 mtime 精度导致版本判断失效
+        time.sleep(0.01)
+        start_time = time.perf_counter()
+        manager.apply([pw.update_section_op("nodes", "UbdghGyO", {f"fenliu_{i}": "node000000"})])
+        timings.append(time.perf_counter() - start_time)
+    return timings
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="PassWall 配置解析 / 序列化压测")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000], help="配置段数量")
+    parser.add_argument("--lookups", type=int, default=1000, help="每种规模的按名称查找次数")
+    parser.add_argument("--mutations", type=int, default=100, help="每种规模修改的配置段数")
+    parser.add_argument("--apply-rounds", type=int, default=5, help="完整读-改-写的轮数，0 表示跳过")
+    args = parser.parse_args()
+
+    pw = load_passwall_module()
+    print(f"{'段数':>8} {'大小KB':>8} {'实现':>7} {'解析ms':>9} {'段/秒':>11} {'查找ms':>9} "
+          f"{'修改ms':>8} {'序列化ms':>9} {'峰值MB':>8}")
+    for section_count in args.sizes:
+        size, rows = bench_size(pw, section_count, args.lookups, args.mutations)
+        for name, parse_time, lookup_time, mutate_time, format_time, peak in rows:
+            print(f"{section_count:>8} {size / 1024:>8.0f} {name:>7} {parse_time * 1000:>9.1f} "
+                  f"{section_count / parse_time:>11.0f} {lookup_time * 1000:>9.2f} {mutate_time * 1000:>8.2f} "
+                  f"{format_time * 1000:>9.1f} {peak / 1024 / 1024:>8.1f}")
+
+    if args.apply_rounds:
+        work_dir = tempfile.mkdtemp(prefix="bench_passwall_")
+        try:
+            timings = bench_apply(pw, work_dir, max(args.sizes), args.apply_rounds)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        print(f"apply（{max(args.sizes)} 段，本地文件）: 首次 {timings[0] * 1000:.1f} ms，"
+              f"缓存命中平均 {sum(timings[1:]) / max(1, len(timings) - 1) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main_cli()
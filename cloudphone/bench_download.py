@@ -0,0 +1,126 @@
+"""
+下载器压测脚本：在本地启动一个支持 Range、按连接限速的 HTTP 服务器，
+对比原来的单连接 1KB 循环下载和 ArtifactStore 的多连接分段下载的吞吐。
+
+用法示例:
+    python bench_download.py --size-mb 256 --rate-mbps 20
+"""
+import argparse
+import asyncio
+import os
+import re
+import shutil
+import tempfile
+import time
+
+import aiofiles
+import aiohttp
+from aiohttp import web
+
+import main
+
+
+def _make_range_app(file_path, rate_bytes):
+    """
+    支持 Range 请求的静态文件服务，每个连接限速 rate_bytes 字节/秒，用于模拟公网下载。
+    """
+    file_size = os.path.getsize(file_path)
+
+    async def handle(request):
+        start, end, status = 0, file_size - 1, 200
+        match = re.match(r"bytes=(\d+)-(\d*)", request.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else file_size - 1
+            status = 206
+        headers = {"Accept-Ranges": "bytes", "ETag": '"bench-%d"' % file_size}
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(file_size)
+            return web.Response(status=200, headers=headers)
+        if status == 206:
+            headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+        response = web.StreamResponse(status=status, headers=headers)
+        response.content_length = end - start + 1
+        await response.prepare(request)
+        chunk_size = 64 * 1024
+        with open(file_path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                await response.write(chunk)
+                remaining -= len(chunk)
+                if rate_bytes:
+                    await asyncio.sleep(len(chunk) / rate_bytes)
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_route("GET", "/{name}", handle)
+    app.router.add_route("HEAD", "/{name}", handle)
+    return app
+
+
+async def _legacy_download(fileurl, dest_path):
+    """
+    原来 download_file 的下载方式：单连接，每次读取 1024 字节。
+    """
+    async with aiohttp.ClientSession() as session:
+        async with session.get(fileurl, timeout=aiohttp.ClientTimeout(total=30*60)) as response:
+            async with aiofiles.open(dest_path, 'wb') as temp_f:
+                while True:
+                    chunk = await response.content.read(1024)  # 每次读取 1024 字节
+                    if not chunk:
+                        break
+                    await temp_f.write(chunk)
+
+
+async def _run(args, work_dir):
+    source_path = os.path.join(work_dir, "source.bin")
+    with open(source_path, "wb") as f:
+        for _ in range(args.size_mb):
+            f.write(os.urandom(1024 * 1024))
+    size = os.path.getsize(source_path)
+
+    runner = web.AppRunner(_make_range_app(source_path, int(args.rate_mbps * 1024 * 1024)))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    fileurl = f"http://127.0.0.1:{args.port}/source.bin"
+
+    try:
+        start_time = time.time()
+        await _legacy_download(fileurl, os.path.join(work_dir, "legacy.bin"))
+        legacy_elapsed = time.time() - start_time
+        print(f"单连接 1KB 循环: {legacy_elapsed:.2f} 秒，{size / legacy_elapsed / 1024 / 1024:.2f} MB/s")
+
+        main.RANGED_DOWNLOAD_CONNECTIONS = args.connections
+        store = main.ArtifactStore(os.path.join(work_dir, "store"), 1 << 62)
+        start_time = time.time()
+        digest = await store.fetch(fileurl)
+        ranged_elapsed = time.time() - start_time
+        print(f"{args.connections} 连接分段下载: {ranged_elapsed:.2f} 秒，{size / ranged_elapsed / 1024 / 1024:.2f} MB/s")
+        assert digest == main._sha256_file(source_path), "分段下载的内容校验失败"
+        print(f"加速比: {legacy_elapsed / ranged_elapsed:.2f}x")
+    finally:
+        if main._http_session is not None:
+            await main._http_session.close()
+        await runner.cleanup()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="下载器吞吐对比")
+    parser.add_argument("--size-mb", type=int, default=128, help="测试文件大小（MB）")
+    parser.add_argument("--rate-mbps", type=float, default=20, help="服务器单连接限速（MB/s），0 表示不限速")
+    parser.add_argument("--connections", type=int, default=main.RANGED_DOWNLOAD_CONNECTIONS, help="分段下载的连接数")
+    parser.add_argument("--port", type=int, default=18765, help="本地测试服务器端口")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_download_")
+    try:
+        asyncio.run(_run(args, work_dir))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,114 @@
+"""
+/uploadfile 大文件上传压测脚本：上传一个多 GB 的文件，同时采样服务端进程的 RSS。
+
+用法示例:
+    python bench_upload.py --url http://127.0.0.1:8000/uploadfile --ip 192.168.10.23 \
+        --size-gb 2 --pid $(pgrep -f "main.py") [--stream]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+import aiohttp
+
+
+def _read_rss_kb(pid):
+    """
+    从 /proc/<pid>/status 读取进程当前的 RSS（KB），读取失败时返回 None。
+    """
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        return None
+    return None
+
+
+class RssSampler(threading.Thread):
+    """
+    后台线程：每隔 interval 秒采样一次 RSS，记录峰值。
+    """
+
+    def __init__(self, pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.baseline_kb = _read_rss_kb(pid)
+        self.peak_kb = self.baseline_kb or 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            rss_kb = _read_rss_kb(self.pid)
+            if rss_kb is not None:
+                self.peak_kb = max(self.peak_kb, rss_kb)
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _make_test_file(size_bytes):
+    """
+    生成指定大小的测试文件（稀疏文件，不占用实际磁盘空间）。
+    """
+    fd, path = tempfile.mkstemp(prefix="bench_upload_", suffix=".bin")
+    os.ftruncate(fd, size_bytes)
+    os.close(fd)
+    return path
+
+
+async def _upload(args, file_path):
+    data = aiohttp.FormData()
+    data.add_field("ip", args.ip)
+    data.add_field("directory", args.directory)
+    data.add_field("filename", os.path.basename(file_path))
+    data.add_field("stream", "true" if args.stream else "false")
+    # 传入文件对象，aiohttp 会分块发送，不会把整个文件读入客户端内存
+    with open(file_path, "rb") as f:
+        data.add_field("file", f, filename=os.path.basename(file_path))
+        timeout = aiohttp.ClientTimeout(total=None)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.post(args.url, data=data) as response:
+                return response.status, await response.text()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/uploadfile 大文件上传压测")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/uploadfile", help="上传接口地址")
+    parser.add_argument("--ip", required=True, help="目标设备 IP")
+    parser.add_argument("--directory", default="/sdcard/Download", help="设备上的目标目录")
+    parser.add_argument("--size-gb", type=float, default=2, help="测试文件大小（GB）")
+    parser.add_argument("--pid", type=int, default=None, help="服务端进程 PID，用于采样 RSS")
+    parser.add_argument("--stream", action="store_true", help="使用 adb exec-in 直写模式")
+    args = parser.parse_args()
+
+    size_bytes = int(args.size_gb * 1024 * 1024 * 1024)
+    file_path = _make_test_file(size_bytes)
+    sampler = RssSampler(args.pid) if args.pid else None
+    try:
+        if sampler:
+            sampler.start()
+        start_time = time.time()
+        status, body = asyncio.run(_upload(args, file_path))
+        elapsed = time.time() - start_time
+    finally:
+        if sampler:
+            sampler.stop()
+        os.remove(file_path)
+
+    print(f"HTTP {status}: {body}")
+    print(f"上传 {size_bytes} 字节，耗时 {elapsed:.2f} 秒，{size_bytes / elapsed / 1024 / 1024:.2f} MB/s")
+    if sampler:
+        print(f"服务端 RSS: 基线 {sampler.baseline_kb} KB，峰值 {sampler.peak_kb} KB，"
+              f"增长 {sampler.peak_kb - (sampler.baseline_kb or 0)} KB")
+
+
+if __name__ == "__main__":
+    main()
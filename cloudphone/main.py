@@ -1,133 +1,785 @@
+import asyncio
 import logging
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-import requests
-import subprocess
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 import aiofiles
 import aiohttp
 import tempfile
+import shutil
+import zipfile
+import contextlib
+import shlex
+import fnmatch
 import os
 import re
+import json
+import time
+import hashlib
+import sqlite3
+import uuid
 from datetime import datetime
 from pydantic import BaseModel
+from typing import List, Optional
 import yaml
 import uvicorn
 import argparse
 from urllib.parse import urlparse
-import traceback
+import metrics
 app = FastAPI()
 
+# 指标定义，通过 /metrics 以 Prometheus 文本格式输出
+HTTP_REQUEST_DURATION = metrics.histogram(
+    "cloudphone_http_request_duration_seconds", "HTTP 请求耗时（流式响应只统计到开始返回）", ("method", "route", "status"))
+HTTP_REQUESTS_IN_FLIGHT = metrics.gauge("cloudphone_http_requests_in_flight", "正在处理的 HTTP 请求数")
+DOCKER_FETCH_DURATION = metrics.histogram(
+    "cloudphone_docker_fetch_duration_seconds", "从 Docker 主机拉取容器列表的耗时", ("host",))
+DOCKER_FETCH_ERRORS = metrics.counter("cloudphone_docker_fetch_errors_total", "拉取容器列表失败次数", ("host",))
+DOCKER_EVENT_STREAM_ERRORS = metrics.counter(
+    "cloudphone_docker_event_stream_errors_total", "Docker 事件流断开或连接失败的次数", ("host",))
+ADB_COMMAND_DURATION = metrics.histogram(
+    "cloudphone_adb_command_duration_seconds", "adb 子进程耗时", ("operation",))
+ADB_COMMAND_FAILURES = metrics.counter(
+    "cloudphone_adb_command_failures_total", "adb 子进程返回非 0 或超时的次数", ("operation",))
+DOWNLOAD_BYTES = metrics.counter("cloudphone_download_bytes_total", "从网络下载的字节数")
+DOWNLOAD_DURATION = metrics.histogram("cloudphone_download_duration_seconds", "单个文件的下载耗时")
+DOWNLOAD_THROUGHPUT = metrics.histogram(
+    "cloudphone_download_throughput_bytes_per_second", "单个文件的下载速度",
+    buckets=tuple(mb * 1024 * 1024 for mb in (0.5, 1, 2, 5, 10, 20, 50, 100, 200)))
+XAPK_EXTRACT_DURATION = metrics.histogram("cloudphone_xapk_extract_duration_seconds", "XAPK 解压耗时")
+CACHE_REQUESTS = metrics.counter(
+    "cloudphone_cache_requests_total", "缓存查询次数，result 为 hit / miss", ("cache", "result"))
+SINGLE_FLIGHT_JOINED = metrics.counter(
+    "cloudphone_single_flight_joined_total", "合并到进行中任务的调用次数", ("kind",))
+JOBS_FINISHED = metrics.counter("cloudphone_jobs_finished_total", "已结束的后台任务数", ("kind", "state"))
+metrics.gauge(
+    "cloudphone_jobs_in_flight", "排队中和执行中的后台任务数", ("kind", "state"),
+    collect=lambda: _count_jobs_in_flight())
+metrics.gauge(
+    "cloudphone_adb_connected_devices", "连接管理器中已连接的设备数",
+    collect=lambda: {(): sum(1 for device in adb_manager.devices.values() if device["connected"])})
+metrics.gauge(
+    "cloudphone_containers", "容器索引中的容器数",
+    collect=lambda: {(): len(_container_index.containers)})
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    HTTP_REQUESTS_IN_FLIGHT.inc()
+    start_time = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_REQUESTS_IN_FLIGHT.dec()
+        # 使用路由模板（如 /jobs/{job_id}）作为标签，避免标签数量无限增长
+        route = request.scope.get("route")
+        HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - start_time,
+            method=request.method, route=route.path if route else "unmatched", status=status
+        )
+
+
 # 定义请求体的数据模型
 class ModifyDevRequest(BaseModel):
     ip: str
     cmdline: str
 
+class ModifyDevBatchRequest(BaseModel):
+    cmdline: str
+    ips: Optional[List[str]] = None  # 设备 IP 列表，支持 192.168.10.* 通配符
+    host: Optional[str] = None  # 未指定 ips 时按容器索引过滤
+    state: Optional[str] = None
+    image: Optional[str] = None
+    concurrency: Optional[int] = None
+    timeout: Optional[float] = None
+
 # Docker API的地址列表，可以添加多个 Docker 主机的 API 地址
 DOCKER_API_URLS = []
 CLASH_PROXY_IP = ""
+# 并发拉取 Docker 主机容器列表时的最大并发数和单个主机的超时时间（秒）
+DOCKER_FETCH_CONCURRENCY = 10
+DOCKER_FETCH_TIMEOUT = 3
+# 共享 aiohttp 连接池大小（Docker 事件流使用单独的连接池，不占用这里的连接）
+HTTP_POOL_LIMIT = 100
+HTTP_POOL_LIMIT_PER_HOST = 10
+_http_session = None
+_events_session = None
+_docker_fetch_semaphore = asyncio.Semaphore(DOCKER_FETCH_CONCURRENCY)
+# Docker 事件流断开后的重连间隔（秒），以及会引起容器状态变化、需要更新索引的事件
+DOCKER_EVENTS_RECONNECT_DELAY = 3
+DOCKER_STATE_EVENTS = {"create", "start", "restart", "die", "stop", "pause", "unpause", "rename", "destroy"}
+_docker_watch_tasks = []
+_synced_hosts = set()
+_container_index_ready = asyncio.Event()
+_process_boot_id = "%x" % int(time.time())
+# adb 连接健康检查间隔、空闲断开时间以及 connect 等短命令的超时（秒）
+ADB_HEALTH_CHECK_INTERVAL = 30
+ADB_IDLE_TIMEOUT = 300
+ADB_CONNECT_TIMEOUT = 15
+_adb_eviction_task = None
+# 上传文件时每次读取的分块大小、进度打印间隔（秒）和临时文件目录（None 表示系统默认）
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_PROGRESS_INTERVAL = 5
+UPLOAD_TEMP_DIR = None
+# 广播上传时默认同时 push 的设备数
+BROADCAST_PARALLELISM = 20
+# /modifydev 请求的超时（秒）以及批量下发时的并发数
+MODIFYDEV_TIMEOUT = 10
+MODIFYDEV_CONCURRENCY = 50
+# 内容寻址下载缓存的目录、总大小上限（字节）以及下载时每次读取的分块大小
+ARTIFACT_STORE_DIR = "/root/mytsdk/store"
+ARTIFACT_STORE_MAX_BYTES = 50 * 1024 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# 大于 RANGED_DOWNLOAD_MIN_SIZE 字节且服务器支持 Range 时，分成 RANGED_DOWNLOAD_CONNECTIONS 段并发下载
+RANGED_DOWNLOAD_MIN_SIZE = 16 * 1024 * 1024
+RANGED_DOWNLOAD_CONNECTIONS = 8
+# XAPK 的清单文件名，以及 split APK 的 ABI / 屏幕密度限定符（密度对应的 dpi）
+XAPK_MANIFEST = "manifest.json"
+ABI_SPLITS = {"arm64_v8a", "armeabi_v7a", "armeabi", "x86", "x86_64", "mips", "mips64"}
+DENSITY_SPLITS = {"ldpi": 120, "mdpi": 160, "tvdpi": 213, "hdpi": 240, "xhdpi": 320, "xxhdpi": 480, "xxxhdpi": 640}
+# 正在进行中的下载 / 解压任务，用于合并同一 URL 的并发请求
+_inflight_downloads = {}
+# 已创建过日志目录的容器 (main_ip, name)
+_known_log_dirs = set()
+
+# 后台任务的 worker 数量、SQLite 任务日志路径（为空时不持久化）和内存中保留的已完成任务数
+JOB_WORKERS = 4
+JOB_JOURNAL_PATH = None
+JOB_HISTORY_LIMIT = 1000
 current_directory = os.path.dirname(os.path.abspath(__file__))
 
-@app.get("/containers")
-async def get_container_list():
-    container_list = []  # 用于存储聚合的容器信息
+def _parse_container(container, docker_api_url):
+    """
+    将 Docker API 返回的单个容器信息转换为接口输出的格式。
+    名称包含 "myt_sdk" 的容器返回 None。
+    """
+    container_id = container.get("Id")  # 获取容器的唯一标识符
+    names = container.get("Names", [])  # 获取容器名称列表
+
+    # 假设我们使用第一个名称作为代表名称，并去掉开头的斜杠 /
+    container_name = names[0].lstrip('/') if names else "unknown"
+    # 过滤掉任何名称包含 "myt_sdk" 的容器
+    if "myt_sdk" in container_name:
+        return None
+
+    image_name = container.get("Image")  # 获取容器的镜像名
+    created_timestamp = container.get("Created")  # 获取容器创建时间戳
+
+    # 格式化创建时间戳为指定格式
+    created_time = datetime.fromtimestamp(created_timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+    state_status = container.get("State")  # 获取容器状态
+    current_status = container.get("Status")  # 获取容器的当前状态描述
+
+    # 从 NetworkSettings 中获取 IP 地址
+    networks = container.get("NetworkSettings", {}).get("Networks", {})
+    ip_address = None
+
+    # 遍历所有网络获取 IP 地址
+    for network_data in networks.values():
+        ip_address = network_data.get("IPAddress")
+        if ip_address:  # 如果找到了 IP 地址，停止遍历
+            break
+
+    # 构建容器详细信息的字典
+    return {
+        "id": container_id,  # 容器的唯一标识符
+        "name": container_name,  # 容器名称
+        "image": image_name,  # 容器使用的镜像名
+        "created": created_time,  # 容器的创建时间，格式化后的字符串
+        "state": state_status,  # 容器的当前状态
+        "status": current_status,  # 容器的状态描述
+        "ip_address": ip_address,  # 容器的 IP 地址
+        "main_ip": re.search(r'http://(\d+\.\d+\.\d+\.\d+):', docker_api_url).group(1)
+    }
 
-    # 遍历每个 Docker API URL，获取容器信息
-    for docker_api_url in DOCKER_API_URLS:
+
+def _get_http_session():
+    """
+    获取全局共享的 aiohttp 会话（带连接池），首次调用时创建。
+    """
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(limit=HTTP_POOL_LIMIT, limit_per_host=HTTP_POOL_LIMIT_PER_HOST)
+        _http_session = aiohttp.ClientSession(connector=connector)
+    return _http_session
+
+
+def _get_events_session():
+    """
+    获取 Docker 事件流专用的 aiohttp 会话：每个 Docker 主机一条长连接，不限制总数。
+    事件流和共享连接池分开，主机很多时长连接不会占满共享连接池，
+    同步容器列表、/modifydev、下载等请求始终有连接可用。
+    """
+    global _events_session
+    if _events_session is None or _events_session.closed:
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=1)
+        _events_session = aiohttp.ClientSession(connector=connector)
+    return _events_session
+
+
+async def _fetch_containers_from_host(docker_api_url):
+    """
+    从单个 Docker 主机拉取容器列表，失败时抛出异常，由调用方记录到错误表中。
+    并发数由 DOCKER_FETCH_CONCURRENCY 限制，每个主机单独使用 DOCKER_FETCH_TIMEOUT 超时。
+    """
+    async with _docker_fetch_semaphore:
+        session = _get_http_session()
+        timeout = aiohttp.ClientTimeout(total=DOCKER_FETCH_TIMEOUT)
+        start_time = time.perf_counter()
         try:
-            # 使用 requests 向 Docker API 发送 GET 请求
-            response = requests.get(docker_api_url, timeout=3)
-
-            # 如果请求成功（状态码为 200）
-            if response.status_code == 200:
-                containers = response.json()  # 将响应内容转换为 JSON 格式
-
-                # 遍历每个容器，提取相关信息
-                for container in containers:
-                    container_id = container.get("Id")  # 获取容器的唯一标识符
-                    names = container.get("Names", [])  # 获取容器名称列表
-
-                    # 假设我们使用第一个名称作为代表名称，并去掉开头的斜杠 /
-                    container_name = names[0].lstrip('/') if names else "unknown"
-                    # 过滤掉任何名称包含 "myt_sdk" 的容器
-                    if "myt_sdk" in container_name:
-                        continue
+            async with session.get(docker_api_url, timeout=timeout) as response:
+                if response.status != 200:
+                    raise Exception(f"Failed to fetch containers from {docker_api_url}: HTTP {response.status}")
+                containers = await response.json()
+        except Exception:
+            DOCKER_FETCH_ERRORS.inc(host=docker_api_url)
+            raise
+        finally:
+            DOCKER_FETCH_DURATION.observe(time.perf_counter() - start_time, host=docker_api_url)
+
+    container_list = []
+    for container in containers:
+        container_info = _parse_container(container, docker_api_url)
+        if container_info is None:
+            continue
+        container_list.append(container_info)
+    return container_list
+
+
+def _ensure_log_dir(container_info):
+    """
+    为容器创建日志目录 /home/logs/<main_ip>/<name>，只对缓存中第一次出现的容器执行。
+    """
+    key = (container_info["main_ip"], container_info["name"])
+    if key in _known_log_dirs:
+        return
+    # 使用正确的语法访问字典中的键
+    pathLog="/home/logs/"+container_info["main_ip"]+"/"+container_info["name"]
+    # 创建这个目录，如果存在则不创建
+    os.makedirs(pathLog, exist_ok=True)
+    _known_log_dirs.add(key)
+
+
+class ContainerIndex:
+    """
+    内存中的容器索引，由各 Docker 主机的 /events 事件流增量维护。
+    key 为 (docker_api_url, 容器 id)，并按主机 / 状态 / 镜像维护二级索引，用于 /containers 的过滤查询。
+    """
+
+    def __init__(self):
+        self.containers = {}
+        self.by_host = {}
+        self.by_state = {}
+        self.by_image = {}
+        self.errors = {}  # 事件流断开的主机及错误信息，key 为 Docker API 地址
+        self.version = 0
+        self.updated_at = 0.0
+        self._snapshot = []
+        self._snapshot_version = 0
+
+    def _bump(self):
+        self.version += 1
+        self.updated_at = time.time()
+
+    @staticmethod
+    def _index_add(index, value, key):
+        index.setdefault(value, set()).add(key)
+
+    @staticmethod
+    def _index_discard(index, value, key):
+        keys = index.get(value)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[value]
+
+    def upsert(self, docker_api_url, container_info):
+        key = (docker_api_url, container_info["id"])
+        old = self.containers.get(key)
+        if old == container_info:
+            return
+        if old is not None:
+            self._unindex(key, old)
+        else:
+            _ensure_log_dir(container_info)
+        self.containers[key] = container_info
+        self._index_add(self.by_host, container_info["main_ip"], key)
+        self._index_add(self.by_state, container_info["state"], key)
+        self._index_add(self.by_image, container_info["image"], key)
+        self._bump()
+
+    def remove(self, docker_api_url, container_id):
+        key = (docker_api_url, container_id)
+        old = self.containers.pop(key, None)
+        if old is None:
+            return
+        self._unindex(key, old)
+        self._bump()
+
+    def _unindex(self, key, container_info):
+        self._index_discard(self.by_host, container_info["main_ip"], key)
+        self._index_discard(self.by_state, container_info["state"], key)
+        self._index_discard(self.by_image, container_info["image"], key)
+
+    def resync_host(self, docker_api_url, container_list):
+        """
+        用一次全量拉取的结果替换该主机在索引中的所有容器（事件流重连时调用）。
+        """
+        latest_ids = {container_info["id"] for container_info in container_list}
+        for key in [key for key in self.containers if key[0] == docker_api_url and key[1] not in latest_ids]:
+            self.remove(*key)
+        for container_info in container_list:
+            self.upsert(docker_api_url, container_info)
+
+    def snapshot(self):
+        """
+        返回所有容器的列表，索引没有变化时直接复用上一次生成的列表。
+        """
+        if self._snapshot_version != self.version:
+            self._snapshot = list(self.containers.values())
+            self._snapshot_version = self.version
+        return self._snapshot
+
+    def query(self, host=None, state=None, image=None):
+        """
+        按主机 / 状态 / 镜像过滤容器，多个条件之间取交集。
+        """
+        key_sets = []
+        if host:
+            key_sets.append(self.by_host.get(host, set()))
+        if state:
+            key_sets.append(self.by_state.get(state, set()))
+        if image:
+            key_sets.append(self.by_image.get(image, set()))
+        if not key_sets:
+            return self.snapshot()
+        key_sets.sort(key=len)
+        keys = key_sets[0].intersection(*key_sets[1:])
+        return [self.containers[key] for key in keys]
+
+
+_container_index = ContainerIndex()
+
+
+def _docker_base_url(docker_api_url):
+    """
+    从 http://ip:2375/containers/json 形式的地址中取出 Docker API 根地址。
+    """
+    parsed_url = urlparse(docker_api_url)
+    return f"{parsed_url.scheme}://{parsed_url.netloc}"
 
-                    image_name = container.get("Image")  # 获取容器的镜像名
-                    created_timestamp = container.get("Created")  # 获取容器创建时间戳
-
-                    # 格式化创建时间戳为指定格式
-                    created_time = datetime.fromtimestamp(created_timestamp).strftime('%Y-%m-%d %H:%M:%S')
-
-                    state_status = container.get("State")  # 获取容器状态
-                    current_status = container.get("Status")  # 获取容器的当前状态描述
-
-                    # 从 NetworkSettings 中获取 IP 地址
-                    networks = container.get("NetworkSettings", {}).get("Networks", {})
-                    ip_address = None
-
-                    # 遍历所有网络获取 IP 地址
-                    for network_data in networks.values():
-                        ip_address = network_data.get("IPAddress")
-                        if ip_address:  # 如果找到了 IP 地址，停止遍历
-                            break
-
-                    # 构建容器详细信息的字典
-                    container_info = {
-                        "id": container_id,  # 容器的唯一标识符
-                        "name": container_name,  # 容器名称
-                        "image": image_name,  # 容器使用的镜像名
-                        "created": created_time,  # 容器的创建时间，格式化后的字符串
-                        "state": state_status,  # 容器的当前状态
-                        "status": current_status,  # 容器的状态描述
-                        "ip_address": ip_address,  # 容器的 IP 地址
-                        "main_ip": re.search(r'http://(\d+\.\d+\.\d+\.\d+):', docker_api_url).group(1)
-                    }
-                    # 使用正确的语法访问字典中的键
-                    pathLog="/home/logs/"+container_info["main_ip"]+"/"+container_info["name"]
-                    # 创建这个目录，如果存在则不创建
-                    os.makedirs(pathLog, exist_ok=True)
-                    # 将容器信息添加到聚合列表中
-                    container_list.append(container_info)
+
+async def _fetch_single_container(docker_api_url, container_id):
+    """
+    使用与列表相同的接口（保留原有查询参数）按 id 查询单个容器，不在列表中时返回 None。
+    """
+    session = _get_http_session()
+    timeout = aiohttp.ClientTimeout(total=DOCKER_FETCH_TIMEOUT)
+    params = {"filters": json.dumps({"id": [container_id]})}
+    async with session.get(docker_api_url, params=params, timeout=timeout) as response:
+        if response.status != 200:
+            raise Exception(f"Failed to fetch container {container_id} from {docker_api_url}: HTTP {response.status}")
+        containers = await response.json()
+    for container in containers:
+        if container.get("Id") == container_id:
+            return _parse_container(container, docker_api_url)
+    return None
+
+
+async def _apply_docker_event(docker_api_url, event):
+    """
+    根据单条容器事件更新索引：destroy 直接删除，其余状态变化重新查询该容器。
+    """
+    action = event.get("Action") or event.get("status") or ""
+    # exec_start: xxx 之类的事件带有后缀，只取动作本身
+    action = action.split(":")[0]
+    if action not in DOCKER_STATE_EVENTS:
+        return
+    container_id = event.get("id") or event.get("Actor", {}).get("ID")
+    if not container_id:
+        return
+    if action == "destroy":
+        _container_index.remove(docker_api_url, container_id)
+        return
+    container_info = await _fetch_single_container(docker_api_url, container_id)
+    if container_info is None:
+        # 已经不在列表中（例如列表只返回运行中的容器而它已停止），或者是 myt_sdk 容器
+        _container_index.remove(docker_api_url, container_id)
+    else:
+        _container_index.upsert(docker_api_url, container_info)
+
+
+async def _watch_docker_events(docker_api_url):
+    """
+    后台任务：订阅单个 Docker 主机的 /events 事件流并增量更新容器索引。
+    每次（重新）连接成功后做一次全量同步，断开后等待 DOCKER_EVENTS_RECONNECT_DELAY 秒重连。
+    """
+    events_url = _docker_base_url(docker_api_url) + "/events"
+    params = {"filters": json.dumps({"type": ["container"]})}
+    # 事件流是长连接，只限制建立连接的时间
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=DOCKER_FETCH_TIMEOUT)
+    while True:
+        try:
+            session = _get_events_session()
+            async with session.get(events_url, params=params, timeout=timeout) as response:
+                if response.status != 200:
+                    raise Exception(f"Failed to subscribe events from {events_url}: HTTP {response.status}")
+                # 先订阅再全量同步，同步期间发生的事件会在之后重放，不会丢失
+                container_list = await _fetch_containers_from_host(docker_api_url)
+                _container_index.resync_host(docker_api_url, container_list)
+                _container_index.errors.pop(docker_api_url, None)
+                _mark_host_synced(docker_api_url)
+                print(f"[_watch_docker_events] 已同步 {docker_api_url}，共 {len(container_list)} 个容器")
+
+                async for line in response.content:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    await _apply_docker_event(docker_api_url, json.loads(line))
+            raise Exception(f"Event stream from {events_url} closed")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                error = f"Timeout connecting to Docker API at {docker_api_url}"
             else:
-                # 如果请求失败，抛出 HTTP 异常，并返回对应的状态码
-                raise HTTPException(status_code=response.status_code, detail=f"Failed to fetch containers from {docker_api_url}")
+                error = f"Error connecting to Docker API at {docker_api_url}: {str(e)}"
+            if _container_index.errors.get(docker_api_url) != error:
+                _container_index.errors[docker_api_url] = error
+                _container_index._bump()
+            _mark_host_synced(docker_api_url)
+            DOCKER_EVENT_STREAM_ERRORS.inc(host=docker_api_url)
+            print(f"[_watch_docker_events] {error}")
+        await asyncio.sleep(DOCKER_EVENTS_RECONNECT_DELAY)
 
-        except requests.exceptions.RequestException as e:
-            # 捕获可能的请求异常，返回 500 服务器错误
-            raise HTTPException(status_code=500, detail=f"Error connecting to Docker API at {docker_api_url}: {str(e)}")
 
-    # 返回包含聚合容器信息的 JSON 响应
-    return {"containers": container_list}
+def _mark_host_synced(docker_api_url):
+    """
+    记录主机已完成第一次同步（成功或失败），所有主机都完成后 /containers 不再等待。
+    """
+    _synced_hosts.add(docker_api_url)
+    if _synced_hosts.issuperset(DOCKER_API_URLS):
+        _container_index_ready.set()
 
-@app.post("/modifydev")
-async def modify_dev(request: ModifyDevRequest):
+
+@app.get("/containers")
+async def get_container_list(request: Request, host: str = None, state: str = None, image: str = None):
+    if not _container_index_ready.is_set():
+        # 刚启动时索引还没有数据，最多等待一次拉取的时间
+        try:
+            await asyncio.wait_for(_container_index_ready.wait(), timeout=DOCKER_FETCH_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+
+    # 同一进程内 version 单调递增，加上启动标识避免重启后 ETag 冲突
+    etag = f'W/"{_process_boot_id}-{_container_index.version}"'
+    if request.headers.get("if-none-match") == etag:
+        CACHE_REQUESTS.inc(cache="containers_etag", result="hit")
+        return Response(status_code=304, headers={"ETag": etag})
+    CACHE_REQUESTS.inc(cache="containers_etag", result="miss")
+
+    # 返回包含聚合容器信息的 JSON 响应，以及事件流断开的主机
+    return JSONResponse(
+        content={
+            "containers": _container_index.query(host=host, state=state, image=image),
+            "errors": _container_index.errors,
+            "updated_at": datetime.fromtimestamp(_container_index.updated_at).strftime('%Y-%m-%d %H:%M:%S')
+        },
+        headers={"ETag": etag}
+    )
+
+async def _post_modifydev(ip, cmdline, timeout=None):
+    """
+    通过共享连接池向设备上的 9082/modifydev 接口发送命令，返回接口的 JSON 响应。
+    """
     # 构建目标接口 URL
-    url = f"http://{request.ip}:9082/modifydev"
+    url = f"http://{ip}:9082/modifydev"
 
     # 构建请求参数
     post_data = {
         'cmd': '6',
-        'cmdline': request.cmdline
+        'cmdline': cmdline
     }
 
     try:
         # 发送 POST 请求到目标接口
-        response = requests.post(url, data=post_data)
-
-        # 如果请求成功，返回目标接口的响应内容
-        if response.status_code == 200:
-            return response.json()  # 假设目标接口返回的是 JSON 格式
-        else:
+        client_timeout = aiohttp.ClientTimeout(total=timeout or MODIFYDEV_TIMEOUT)
+        async with _get_http_session().post(url, data=post_data, timeout=client_timeout) as response:
+            # 如果请求成功，返回目标接口的响应内容
+            if response.status == 200:
+                return await response.json(content_type=None)  # 假设目标接口返回的是 JSON 格式
             # 如果请求失败，抛出 HTTP 异常，并返回对应的状态码
-            raise HTTPException(status_code=response.status_code, detail="Error executing command")
+            raise HTTPException(status_code=response.status, detail="Error executing command")
 
-    except requests.exceptions.RequestException as e:
-        # 捕获可能的请求异常，返回 500 服务器错误
-        raise HTTPException(status_code=500, detail=f"Error connecting to {url}: {str(e)}")
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        # 捕获可能的请求异常（包括超时），返回 500 服务器错误
+        raise HTTPException(status_code=500, detail=f"Error connecting to {url}: {str(e) or type(e).__name__}")
+
+
+@app.post("/modifydev")
+async def modify_dev(request: ModifyDevRequest):
+    return await _post_modifydev(request.ip, request.cmdline)
+
+
+@app.post("/modifydev/batch")
+async def modify_dev_batch(request: Request, batch: ModifyDevBatchRequest):
+    """
+    向多台设备并发发送同一条 modifydev 命令。设备由 ips（支持通配符）指定，
+    或者按容器索引的 host / state / image 过滤。每台设备完成后立即以 NDJSON 返回一行结果；
+    请求头 Accept: text/event-stream 时返回 SSE。
+    """
+    if batch.ips:
+        device_ips = _expand_device_ips(",".join(batch.ips))
+    elif batch.host or batch.state or batch.image:
+        containers = _container_index.query(host=batch.host, state=batch.state, image=batch.image)
+        device_ips = list(dict.fromkeys(c["ip_address"] for c in containers if c.get("ip_address")))
+    else:
+        raise HTTPException(status_code=400, detail="ips or one of host / state / image must be specified")
+    if not device_ips:
+        raise HTTPException(status_code=400, detail="No device matched the given ips or filter")
+
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    semaphore = asyncio.Semaphore(batch.concurrency or MODIFYDEV_CONCURRENCY)
+
+    async def modify_one(ip):
+        start_time = time.time()
+        result = {"ip": ip}
+        try:
+            async with semaphore:
+                result["response"] = await _post_modifydev(ip, batch.cmdline, batch.timeout)
+            result["success"] = True
+        except HTTPException as e:
+            result["success"] = False
+            result["status_code"] = e.status_code
+            result["error"] = e.detail
+        result["elapsed"] = round(time.time() - start_time, 3)
+        return result
+
+    async def event_stream():
+        tasks = [asyncio.ensure_future(modify_one(ip)) for ip in device_ips]
+        success_count = 0
+        try:
+            for future in asyncio.as_completed(tasks):
+                result = await future
+                success_count += 1 if result["success"] else 0
+                yield _format_stream_event({"event": "device", **result}, sse)
+        finally:
+            # 客户端提前断开时取消剩余的请求
+            for task in tasks:
+                task.cancel()
+        yield _format_stream_event({
+            "event": "done",
+            "success": success_count,
+            "failed": len(device_ips) - success_count
+        }, sse)
+
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(event_stream(), media_type=media_type)
+
+
+async def _run_adb(*args, timeout=None, cwd=None):
+    """
+    使用 asyncio 子进程执行 adb 命令，不阻塞事件循环。
+
+    :return: (返回码, stdout, stderr)
+    """
+    # 跳过 -s <serial>，以子命令（connect / push / install-multiple / shell ...）作为指标标签
+    operation = args[2] if len(args) > 2 and args[0] == "-s" else (args[0] if args else "")
+    start_time = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        "adb", *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        ADB_COMMAND_FAILURES.inc(operation=operation)
+        raise Exception(f"adb {' '.join(args)} 执行超时 ({timeout} 秒)")
+    finally:
+        ADB_COMMAND_DURATION.observe(time.perf_counter() - start_time, operation=operation)
+    if process.returncode != 0:
+        ADB_COMMAND_FAILURES.inc(operation=operation)
+    return process.returncode, stdout.decode(errors="replace").strip(), stderr.decode(errors="replace").strip()
+
+
+class AdbDeviceManager:
+    """
+    按 ip:5555 维护常驻的 adb 连接，替代每个请求 connect / disconnect 一次的做法。
+    同一设备上的操作串行执行，不同设备之间互不影响；连接定期做健康检查，空闲过久的连接会被断开。
+    """
+
+    def __init__(self):
+        self.devices = {}  # adb_serial -> {"lock", "connected", "last_checked", "last_used", "users"}
+
+    def _get_device(self, adb_serial):
+        device = self.devices.get(adb_serial)
+        if device is None:
+            # users 为正在使用或等待这把锁的请求数，不为 0 时不能清理
+            device = {"lock": asyncio.Lock(), "connected": False, "last_checked": 0.0, "last_used": time.time(), "users": 0}
+            self.devices[adb_serial] = device
+        return device
+
+    async def _ensure_connected(self, adb_serial, device):
+        now = time.time()
+        if device["connected"]:
+            if now - device["last_checked"] < ADB_HEALTH_CHECK_INTERVAL:
+                return
+            # 超过健康检查间隔，确认设备仍然在线
+            returncode, state, _ = await _run_adb("-s", adb_serial, "get-state", timeout=ADB_CONNECT_TIMEOUT)
+            if returncode == 0 and state == "device":
+                device["last_checked"] = now
+                return
+            print(f"[AdbDeviceManager] 设备 {adb_serial} 不在线 ({state})，重新连接")
+
+        # 连接到指定 IP 地址的设备 (使用 5555 端口)
+        returncode, output, error = await _run_adb("connect", adb_serial, timeout=ADB_CONNECT_TIMEOUT)
+        # adb connect 失败时返回码也可能是 0，需要检查输出（connected to / already connected to）
+        if returncode != 0 or "connected to" not in output:
+            device["connected"] = False
+            raise HTTPException(status_code=500, detail=f"Failed to connect to device {adb_serial}: {error or output}")
+        device["connected"] = True
+        device["last_checked"] = now
+
+    @contextlib.asynccontextmanager
+    async def device(self, ip):
+        """
+        获取设备的独占使用权并确保已连接，返回 adb 序列号。
+
+        用法: async with adb_manager.device(ip) as adb_serial: ...
+        """
+        adb_serial = f"{ip}:5555"
+        device = self._get_device(adb_serial)
+        device["users"] += 1
+        try:
+            async with device["lock"]:
+                await self._ensure_connected(adb_serial, device)
+                try:
+                    yield adb_serial
+                except BaseException:
+                    # 操作失败时下次使用前强制做一次健康检查
+                    device["last_checked"] = 0.0
+                    raise
+                finally:
+                    device["last_used"] = time.time()
+        finally:
+            device["users"] -= 1
+
+    async def _disconnect(self, adb_serial):
+        returncode, _, error = await _run_adb("disconnect", adb_serial, timeout=ADB_CONNECT_TIMEOUT)
+        if returncode != 0:
+            print(f"警告: 无法断开与 {adb_serial} 的连接: {error}")
+
+    async def evict_idle(self):
+        """
+        断开空闲超过 ADB_IDLE_TIMEOUT 秒且当前没有在使用的设备连接。
+        """
+        now = time.time()
+        for adb_serial, device in list(self.devices.items()):
+            if device["users"] or now - device["last_used"] < ADB_IDLE_TIMEOUT:
+                continue
+            async with device["lock"]:
+                if device["connected"]:
+                    print(f"[AdbDeviceManager] 断开空闲设备 {adb_serial}")
+                    device["connected"] = False
+                    await self._disconnect(adb_serial)
+                # 断开期间可能有新请求在等待这把锁，此时保留记录，让它们继续共用同一把锁（下次使用时重新连接）
+                if device["users"] == 0 and self.devices.get(adb_serial) is device:
+                    del self.devices[adb_serial]
+
+    async def close(self):
+        """
+        断开所有由管理器维护的连接（服务关闭时调用）。
+        """
+        for adb_serial, device in list(self.devices.items()):
+            if device["connected"]:
+                await self._disconnect(adb_serial)
+        self.devices.clear()
+
+
+adb_manager = AdbDeviceManager()
+
+
+async def _adb_idle_eviction_loop():
+    """
+    后台任务：定期清理空闲的 adb 连接。
+    """
+    while True:
+        await asyncio.sleep(ADB_HEALTH_CHECK_INTERVAL)
+        try:
+            await adb_manager.evict_idle()
+        except Exception as e:
+            print(f"[_adb_idle_eviction_loop] 清理空闲连接失败: {str(e)}")
+
+
+async def _copy_upload_in_chunks(file: UploadFile, write_chunk, label):
+    """
+    分块读取上传的文件并交给 write_chunk 写出，内存占用只有一个分块大小。
+    过程中按 UPLOAD_PROGRESS_INTERVAL 秒打印一次进度和速度。
+
+    :return: (总字节数, 耗时秒数)
+    """
+    total_bytes = 0
+    start_time = time.time()
+    last_report = start_time
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        await write_chunk(chunk)
+        total_bytes += len(chunk)
+        now = time.time()
+        if now - last_report >= UPLOAD_PROGRESS_INTERVAL:
+            speed = total_bytes / max(now - start_time, 1e-6)
+            print(f"[upload] {label} 已传输 {total_bytes} 字节，{speed / 1024 / 1024:.2f} MB/s")
+            last_report = now
+    return total_bytes, time.time() - start_time
+
+
+async def _pipe_upload_to_device(file: UploadFile, adb_serial, target_path):
+    """
+    不落盘，直接把上传的文件流通过 adb exec-in 写入设备上的目标路径。
+    """
+    process = await asyncio.create_subprocess_exec(
+        "adb", "-s", adb_serial, "exec-in", f"cat > {shlex.quote(target_path)}",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+
+    async def write_chunk(chunk):
+        process.stdin.write(chunk)
+        await process.stdin.drain()
+
+    try:
+        result = await _copy_upload_in_chunks(file, write_chunk, f"{adb_serial}:{target_path}")
+        process.stdin.close()
+    except BaseException:
+        process.kill()
+        await process.wait()
+        raise
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise HTTPException(status_code=500, detail=f"Error pushing file to device: {stderr.decode(errors='replace').strip()}")
+    return result
 
 
 @app.post("/uploadfile")
-async def upload_file_to_device(ip: str = Form(...), directory: str = Form(...), filename: str = Form(...), file: UploadFile = File(...)):
+async def upload_file_to_device(
+        ip: str = Form(...),
+        directory: str = Form(...),
+        filename: str = Form(...),
+        file: UploadFile = File(...),
+        stream: bool = Form(False, description="为 true 时不经过临时文件，直接通过 adb exec-in 写入设备")
+):
     # 检查是否提供了有效的 IP 地址、目录和文件名
     if not ip or not directory or not filename:
         raise HTTPException(status_code=400, detail="IP, target directory, and filename must be specified")
@@ -137,29 +789,24 @@ async def upload_file_to_device(ip: str = Form(...), directory: str = Form(...),
     temp_file_path = None  # 初始化 temp_file_path 避免未定义时引用
 
     try:
-        # 设备序列号使用 IP 地址和端口
-        adb_serial = f"{ip}:5555"
-
-        # 连接到指定 IP 地址的设备 (使用 5555 端口)
-        connect_process = subprocess.run(["adb", "connect", adb_serial], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if connect_process.returncode != 0:
-            raise HTTPException(status_code=500, detail=f"Failed to connect to device {adb_serial}: {connect_process.stderr.decode()}")
-
-        # 创建一个临时文件，用于存储上传的文件流
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            temp_file_path = temp_file.name  # 获取临时文件的路径
+        async with adb_manager.device(ip) as adb_serial:
+            if stream:
+                total_bytes, elapsed = await _pipe_upload_to_device(file, adb_serial, target_path)
+            else:
+                # 创建一个临时文件，用于存储上传的文件流
+                with tempfile.NamedTemporaryFile(delete=False, dir=UPLOAD_TEMP_DIR) as temp_file:
+                    temp_file_path = temp_file.name  # 获取临时文件的路径
 
-            # 异步写入上传文件的内容到临时文件
-            async with aiofiles.open(temp_file_path, 'wb') as temp_f:
-                content = await file.read()  # 读取整个文件内容
-                await temp_f.write(content)  # 写入到临时文件
+                # 分块写入上传文件的内容到临时文件，不把整个文件读入内存
+                async with aiofiles.open(temp_file_path, 'wb') as temp_f:
+                    total_bytes, elapsed = await _copy_upload_in_chunks(file, temp_f.write, temp_file_path)
 
-        # 使用 adb push 命令上传临时文件到设备上的指定路径
-        push_process = subprocess.run(["adb", "-s", adb_serial, "push", temp_file_path, target_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                # 使用 adb push 命令上传临时文件到设备上的指定路径
+                returncode, _, error = await _run_adb("-s", adb_serial, "push", temp_file_path, target_path)
 
-        # 检查 adb push 命令是否执行成功
-        if push_process.returncode != 0:
-            raise HTTPException(status_code=500, detail=f"Error pushing file to device: {push_process.stderr.decode()}")
+                # 检查 adb push 命令是否执行成功
+                if returncode != 0:
+                    raise HTTPException(status_code=500, detail=f"Error pushing file to device: {error}")
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error executing adb command: {str(e)}")
@@ -169,10 +816,140 @@ async def upload_file_to_device(ip: str = Form(...), directory: str = Form(...),
         if temp_file_path and os.path.exists(temp_file_path):
             os.remove(temp_file_path)
 
-        # 断开与设备的连接
-        subprocess.run(["adb", "disconnect", adb_serial], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return {
+        "filename": filename,
+        "target_path": target_path,
+        "bytes": total_bytes,
+        "bytes_per_sec": int(total_bytes / max(elapsed, 1e-6))
+    }
 
-    return {"filename": filename, "target_path": target_path}
+def _expand_device_ips(ips):
+    """
+    解析逗号 / 空白分隔的 IP 列表，支持 192.168.10.* 这样的通配符，
+    通配符会在容器索引中已知的设备 IP 上展开。结果去重并保持顺序。
+    """
+    known_ips = None
+    expanded = []
+    for item in re.split(r"[,\s]+", ips.strip()):
+        if not item:
+            continue
+        if any(c in item for c in "*?["):
+            if known_ips is None:
+                known_ips = sorted({c["ip_address"] for c in _container_index.snapshot() if c.get("ip_address")})
+            expanded.extend(fnmatch.filter(known_ips, item))
+        else:
+            expanded.append(item)
+    return list(dict.fromkeys(expanded))
+
+
+async def _push_file_to_device(ip, local_path, target_path, semaphore):
+    """
+    在并发上限内把本地文件 push 到单个设备，返回该设备的结果，不抛出异常。
+    """
+    start_time = time.time()
+    result = {"ip": ip, "target_path": target_path}
+    try:
+        async with semaphore:
+            async with adb_manager.device(ip) as adb_serial:
+                returncode, _, error = await _run_adb("-s", adb_serial, "push", local_path, target_path)
+        if returncode != 0:
+            raise Exception(f"Error pushing file to device: {error}")
+        result["success"] = True
+    except Exception as e:
+        result["success"] = False
+        result["error"] = e.detail if isinstance(e, HTTPException) else str(e)
+    result["elapsed"] = round(time.time() - start_time, 3)
+    return result
+
+
+def _format_stream_event(event, sse):
+    """
+    按 NDJSON 或 SSE 格式编码一条进度事件。
+    """
+    data = json.dumps(event, ensure_ascii=False)
+    if sse:
+        return f"event: {event['event']}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+@app.post("/uploadfile_broadcast")
+async def upload_file_broadcast(
+        request: Request,
+        ips: str = Form(..., description="设备 IP 列表，逗号或空白分隔，支持 192.168.10.* 通配符"),
+        directory: str = Form(...),
+        filename: str = Form(...),
+        file: UploadFile = File(None),
+        fileurl: str = Form(None),
+        parallelism: int = Form(None, description="同时 push 的设备数，默认 BROADCAST_PARALLELISM")
+):
+    """
+    只上传（或下载）一次文件，然后并发 push 到多台设备。
+    每台设备完成后立即以 NDJSON 返回一行结果；请求头 Accept: text/event-stream 时返回 SSE。
+    """
+    if not directory or not filename or (file is None and not fileurl):
+        raise HTTPException(status_code=400, detail="directory, filename, and file or fileurl must be specified")
+    device_ips = _expand_device_ips(ips)
+    if not device_ips:
+        raise HTTPException(status_code=400, detail="No device matched the given ips")
+
+    target_path = f"{directory}/{filename}"
+    temp_file_path = None
+    pinned_digest = None
+    # 先把文件暂存到本地一次，所有设备共用
+    try:
+        if file is not None:
+            with tempfile.NamedTemporaryFile(delete=False, dir=UPLOAD_TEMP_DIR) as temp_file:
+                temp_file_path = temp_file.name
+            async with aiofiles.open(temp_file_path, 'wb') as temp_f:
+                total_bytes, elapsed = await _copy_upload_in_chunks(file, temp_f.write, temp_file_path)
+            local_path = temp_file_path
+        else:
+            start_time = time.time()
+            # 推送结束前缓存中的文件不能被淘汰，响应结束后释放
+            local_path = await download_file(fileurl, "/opt", keep_pinned=True)
+            pinned_digest = os.path.basename(local_path)
+            total_bytes, elapsed = os.path.getsize(local_path), time.time() - start_time
+    except Exception as e:
+        if temp_file_path and os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+        raise HTTPException(status_code=500, detail=f"Error staging file: {str(e)}")
+
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    semaphore = asyncio.Semaphore(parallelism or BROADCAST_PARALLELISM)
+
+    async def event_stream():
+        try:
+            yield _format_stream_event({
+                "event": "staged",
+                "filename": filename,
+                "bytes": total_bytes,
+                "elapsed": round(elapsed, 3),
+                "devices": len(device_ips)
+            }, sse)
+            tasks = [asyncio.ensure_future(_push_file_to_device(ip, local_path, target_path, semaphore)) for ip in device_ips]
+            success_count = 0
+            try:
+                for future in asyncio.as_completed(tasks):
+                    result = await future
+                    success_count += 1 if result["success"] else 0
+                    yield _format_stream_event({"event": "device", **result}, sse)
+            finally:
+                # 客户端提前断开时取消剩余的 push
+                for task in tasks:
+                    task.cancel()
+            yield _format_stream_event({
+                "event": "done",
+                "success": success_count,
+                "failed": len(device_ips) - success_count
+            }, sse)
+        finally:
+            if temp_file_path and os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    # 客户端在开始读取前断开时生成器不会执行 finally，占用改在响应结束后的后台任务中释放
+    background = BackgroundTask(artifact_store.release, pinned_digest) if pinned_digest else None
+    return StreamingResponse(event_stream(), media_type=media_type, background=background)
 
 @app.post("/uploadFileExit")
 async def upload_file_exit(filename: str = Form(...)):
@@ -215,126 +992,201 @@ async def upload_file_from_url(
         ip: str = Form(...),
         directory: str = Form(...),
         filename: str = Form(...),
-        fileurl: str = Form(...)
+        fileurl: str = Form(...),
+        wait: bool = Form(False, description="为 true 时等待任务完成后再返回结果")
 ):
     # 检查是否提供了有效的参数
     if not ip or not directory or not filename or not fileurl:
         raise HTTPException(status_code=400, detail="IP, directory, filename, and fileurl must be specified")
 
+    # 下载 + 推送可能耗时很久，作为后台任务执行，默认立即返回任务 ID
+    params = {"ip": ip, "directory": directory, "filename": filename, "fileurl": fileurl}
+    return await _submit_job("uploadfile_url", params, ip, wait)
+
+
+async def _upload_file_from_url_job(job):
+    params = job["params"]
     # 拼接目标路径
-    target_path = f"{directory}/{filename}"
+    target_path = f"{params['directory']}/{params['filename']}"
 
     # 临时文件路径
     temp_file_path = "/opt"
     try:
-        # 设备序列号使用 IP 地址和端口
-        adb_serial = f"{ip}:5555"
-
-        # 连接到指定 IP 地址的设备 (使用 5555 端口)
-        connect_process = subprocess.run(["adb", "connect", adb_serial], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if connect_process.returncode != 0:
-            raise HTTPException(status_code=500, detail=f"Failed to connect to device {adb_serial}: {connect_process.stderr.decode()}")
+        # 下载期间不占用设备，下载完成后再获取设备连接
+        job["progress"] = "downloading"
+        temp_file_path = await download_file(params["fileurl"], temp_file_path, keep_pinned=True)
 
-        # # 创建一个临时文件，用于存储下载的文件内容
-        # with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        #     temp_file_path = temp_file.name  # 获取临时文件的路径
-
-        temp_file_path = await download_file(fileurl, temp_file_path)
-
-        # 使用 adb push 命令上传临时文件到设备上的指定路径
-        push_process = subprocess.run(["adb", "-s", adb_serial, "push", temp_file_path, target_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        job["progress"] = "pushing"
+        try:
+            async with adb_manager.device(params["ip"]) as adb_serial:
+                # 使用 adb push 命令上传临时文件到设备上的指定路径
+                returncode, _, error = await _run_adb("-s", adb_serial, "push", temp_file_path, target_path)
 
-        # 检查 adb push 命令是否执行成功
-        if push_process.returncode != 0:
-            raise HTTPException(status_code=500, detail=f"Error pushing file to device: {push_process.stderr.decode()}")
+                # 检查 adb push 命令是否执行成功
+                if returncode != 0:
+                    raise HTTPException(status_code=500, detail=f"Error pushing file to device: {error}")
+        finally:
+            artifact_store.release(os.path.basename(temp_file_path))
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
-    finally:
-        # 删除临时文件
-        # if temp_file_path and os.path.exists(temp_file_path):
-        #     os.remove(temp_file_path)
-        # 断开与设备的连接
-        subprocess.run(["adb", "disconnect", adb_serial], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    return {"filename": filename, "target_path": target_path, "fileurl": fileurl}
+    return {"filename": params["filename"], "target_path": target_path, "fileurl": params["fileurl"]}
 
 @app.post("/install_xapk_folder")
 async def install_xapk_folder(
         ip: str = Form(..., description="ADB设备的IP地址"),
-        xapk_folder_path: str = Form(..., description="已解压的XAPK文件夹在服务器上的本地路径")
+        xapk_folder_path: str = Form(..., description="已解压的XAPK文件夹在服务器上的本地路径"),
+        wait: bool = Form(False, description="为 true 时等待安装完成后再返回结果")
 ):
     """
     安装一个已解压的XAPK文件夹中的所有APK文件。
     该文件夹应包含主APK和所有分包APK文件。
+    默认作为后台任务执行并立即返回任务 ID，通过 /jobs/{job_id} 查询进度。
     """
-    adb_serial = f"{ip}:5555" # ADB设备的序列号，格式为 IP:端口
+    # 验证XAPK文件夹；下载得到的XAPK目录指向缓存，APK 按需从缓存中解压
+    if not os.path.isdir(xapk_folder_path):
+        raise HTTPException(status_code=400, detail=f"指定的XAPK文件夹 '{xapk_folder_path}' 不存在或不是一个目录。")
+    return await _submit_job("install_xapk_folder", {"ip": ip, "xapk_folder_path": xapk_folder_path}, ip, wait)
 
-    try:
-        # 1. 连接到指定 IP 地址的设备 (使用 5555 端口)
-        print(f"尝试连接到 ADB 设备: {adb_serial}")
-        connect_process = subprocess.run(
-            ["adb", "connect", adb_serial],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            check=True # 检查返回码，如果非零则抛出 CalledProcessError
-        )
-        print(f"ADB 连接输出: {connect_process.stdout.decode().strip()}")
-
-        # 2. 验证并查找文件夹中的所有APK文件
-        if not os.path.isdir(xapk_folder_path):
-            raise HTTPException(status_code=400, detail=f"指定的XAPK文件夹 '{xapk_folder_path}' 不存在或不是一个目录。")
-
-        # 4. 使用 adb install-multiple 命令安装所有APK文件
-        # 注意: 使用 shell=True 时，install_command 应该是一个完整的字符串
-        # 并且 shell 会在 cwd 指定的目录中展开 *.apk
-        install_command = f"adb -s {adb_serial} install-multiple *.apk"
-
-        print(f"将在目录 '{xapk_folder_path}' 中执行的命令: {install_command}")
-        install_process = subprocess.run(
-            install_command,
-            cwd=xapk_folder_path, # <--- 关键修改: 设置当前工作目录为 XAPK 文件夹路径
-            shell=True,          # <--- 关键修改: 允许 shell 解析命令字符串和通配符
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            check=True # 检查返回码，如果非零则抛出 CalledProcessError
-        )
 
-        # 检查 adb install-multiple 命令是否执行成功
-        install_output = install_process.stdout.decode().strip()
-        install_error = install_process.stderr.decode().strip()
-
-        if "Success" not in install_output:
-            # 如果安装失败，则抛出异常，并包含错误信息
-            raise HTTPException(status_code=500, detail=f"APK安装失败: {install_error if install_error else install_output}")
+async def _install_xapk_folder_job(job):
+    params = job["params"]
+    try:
+        digest = _store_digest_for_dir(params["xapk_folder_path"])
 
-        return {"message": "XAPK文件夹中的APK文件安装成功！", "output": install_output}
+        # 按设备 ABI / 屏幕密度挑选 split APK 后安装，OBB 文件同时推送
+        job["progress"] = "installing"
+        with artifact_store.pinned(digest):
+            result = await _install_xapk_on_device(params["ip"], params["xapk_folder_path"], digest)
+        return {"message": "XAPK文件夹中的APK文件安装成功！", **result}
 
-    except subprocess.CalledProcessError as e:
-        # 处理 subprocess 引起的错误 (如 adb 命令执行失败)
-        error_detail = e.stderr.decode().strip() if e.stderr else e.output.decode().strip()
-        print(f"ADB 命令执行失败 (返回码: {e.returncode}): {error_detail}")
-        raise HTTPException(status_code=500, detail=f"ADB 命令执行失败 (返回码: {e.returncode}): {error_detail}")
+    except HTTPException:
+        raise
     except Exception as e:
         # 捕获所有其他潜在错误
         print(f"安装过程中发生未知错误: {str(e)}")
         raise HTTPException(status_code=500, detail=f"安装过程中发生错误: {str(e)}")
 
-    finally:
-        # 断开与设备的连接 (即使安装失败也要尝试断开)
-        # 确保 adb_serial 已定义，以防前面代码出错导致未定义
-        if 'adb_serial' in locals():
-            print(f"尝试断开与 ADB 设备: {adb_serial} 的连接")
-            disconnect_process = subprocess.run(
-                ["adb", "disconnect", adb_serial],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            if disconnect_process.returncode != 0:
-                print(f"警告: 无法断开与 {adb_serial} 的连接: {disconnect_process.stderr.decode().strip()}")
-            else:
-                print(f"已成功断开与 {adb_serial} 的连接。")
+
+@app.post("/install_xapk")
+async def install_xapk(
+        request: Request,
+        ips: str = Form(..., description="设备 IP 列表，逗号或空白分隔，支持 192.168.10.* 通配符"),
+        fileurl: str = Form(None, description="XAPK 下载地址"),
+        xapk_folder_path: str = Form(None, description="已解压的XAPK文件夹在服务器上的本地路径"),
+        parallelism: int = Form(None, description="同时安装的设备数，默认 BROADCAST_PARALLELISM")
+):
+    """
+    在多台设备上并发安装同一个 XAPK。XAPK 只下载一次，每台设备只解压并安装与其 ABI / 屏幕密度匹配的 split APK。
+    每台设备完成后立即以 NDJSON 返回一行结果；请求头 Accept: text/event-stream 时返回 SSE。
+    """
+    if not fileurl and not xapk_folder_path:
+        raise HTTPException(status_code=400, detail="fileurl or xapk_folder_path must be specified")
+    device_ips = _expand_device_ips(ips)
+    if not device_ips:
+        raise HTTPException(status_code=400, detail="No device matched the given ips")
+
+    pinned = False
+    try:
+        if fileurl:
+            if not __get_file_name_by_url(fileurl).lower().endswith(".xapk"):
+                raise HTTPException(status_code=400, detail="fileurl must point to an .xapk file")
+            blob_path = await download_file(fileurl, "/opt", keep_pinned=True)
+            digest = os.path.basename(blob_path)
+            pinned = True
+            xapk_dir = artifact_store.unpacked_path(digest)
+        else:
+            if not os.path.isdir(xapk_folder_path):
+                raise HTTPException(status_code=400, detail=f"指定的XAPK文件夹 '{xapk_folder_path}' 不存在或不是一个目录。")
+            digest = _store_digest_for_dir(xapk_folder_path)
+            pinned = digest is not None and artifact_store.acquire(digest)
+            xapk_dir = xapk_folder_path
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    semaphore = asyncio.Semaphore(parallelism or BROADCAST_PARALLELISM)
+
+    async def install_one(ip):
+        start_time = time.time()
+        result = {"ip": ip}
+        try:
+            async with semaphore:
+                result.update(await _install_xapk_on_device(ip, xapk_dir, digest))
+            result["success"] = True
+        except Exception as e:
+            result["success"] = False
+            result["error"] = e.detail if isinstance(e, HTTPException) else str(e)
+        result["elapsed"] = round(time.time() - start_time, 3)
+        return result
+
+    async def event_stream():
+        tasks = [asyncio.ensure_future(install_one(ip)) for ip in device_ips]
+        success_count = 0
+        try:
+            for future in asyncio.as_completed(tasks):
+                result = await future
+                success_count += 1 if result["success"] else 0
+                yield _format_stream_event({"event": "device", **result}, sse)
+        finally:
+            # 客户端提前断开时取消剩余的安装
+            for task in tasks:
+                task.cancel()
+        yield _format_stream_event({
+            "event": "done",
+            "success": success_count,
+            "failed": len(device_ips) - success_count
+        }, sse)
+
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    # 所有设备安装结束前缓存中的 XAPK 和解压目录不能被淘汰，响应结束后释放
+    background = BackgroundTask(artifact_store.release, digest) if pinned else None
+    return StreamingResponse(event_stream(), media_type=media_type, background=background)
+
+async def _submit_job(kind, params, device, wait):
+    """
+    提交后台任务。wait 为 false 时立即返回 202 和任务 ID；为 true 时等待任务结束，按原来的同步接口返回结果或错误。
+    """
+    job = await job_scheduler.submit(kind, params, device)
+    if not wait:
+        return JSONResponse(status_code=202, content={"job_id": job["id"], "state": job["state"]})
+    job = await job_scheduler.wait(job["id"])
+    if job["state"] == "failed":
+        raise HTTPException(status_code=job.get("status_code") or 500, detail=job["error"])
+    return job["result"]
+
+
+def _count_jobs_in_flight():
+    counts = {}
+    for job in job_scheduler.jobs.values():
+        if job["state"] in ("queued", "running"):
+            counts[(job["kind"], job["state"])] = counts.get((job["kind"], job["state"]), 0) + 1
+    return counts
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return job
+
+
+@app.get("/jobs")
+async def list_jobs(state: str = None, kind: str = None, ip: str = None):
+    """
+    按状态（queued / running / succeeded / failed）、任务类型、设备 IP 过滤任务列表，按提交时间排序。
+    """
+    return {"jobs": job_scheduler.list(state=state, kind=kind, device=ip)}
+
 
 @app.post("/read-config")
 async def read_config():
@@ -378,39 +1230,416 @@ async def write_config(config_content: str = Form(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"写入配置文件时发生错误: {str(e)}")
 
-async def download_file(fileurl, temp_file_path):
-    filename = __get_file_name_by_url(fileurl)
-    temp_file_path = os.path.join(temp_file_path, filename)
-    print(filename)
-    print(temp_file_path)
-    if os.path.exists(temp_file_path):
-        print("[download_file] 文件已存在 {}".format(temp_file_path))
-        return temp_file_path
-        pass
-    else:
-        # 下载文件内容并保存到临时文件
+class RangeNotSatisfiedError(Exception):
+    """服务器对 Range 请求返回了 200（整个文件），不能分段下载。"""
+
+
+class ArtifactStore:
+    """
+    按 SHA-256 内容寻址的下载缓存。
+
+    目录结构:
+        blobs/<digest[:2]>/<digest>   下载的文件内容
+        unpacked/<digest>/            XAPK 解压后的目录
+        tmp/                          下载 / 解压中的临时文件，完成后再 rename 到正式位置
+        manifest.json                 URL -> digest 的索引，以及每个 digest 的大小和最近访问时间
+
+    总大小超过 max_bytes 时按最近访问时间（LRU）淘汰。正在 push / 安装的内容用 acquire() 占用，
+    占用期间不会被淘汰。
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.manifest_path = os.path.join(root, "manifest.json")
+        self.lock = asyncio.Lock()
+        self.manifest = None
+        self.pins = {}      # digest -> 占用计数
+
+    def _load_manifest(self):
+        if self.manifest is not None:
+            return
+        for sub_dir in ("blobs", "unpacked", "tmp"):
+            os.makedirs(os.path.join(self.root, sub_dir), exist_ok=True)
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(fileurl, timeout=aiohttp.ClientTimeout(total=30*60)) as response:
-                    if response.status != 200:
-                        raise HTTPException(status_code=500, detail=f"Failed to download file from URL: {fileurl}")
-                    async with aiofiles.open(temp_file_path, 'wb') as temp_f:
-                        while True:
-                            chunk = await response.content.read(1024)  # 每次读取 1024 字节
-                            if not chunk:
-                                break
-                            await temp_f.write(chunk)
-            print(f"[download_file] 文件下载完成: {temp_file_path}")
-            await _process_downloaded_file(temp_file_path)
-        except Exception as e:
-            error_message = f"Error while downloading file from URL: {fileurl}\n"
-            stack_trace = traceback.format_exc()
-            print(error_message + stack_trace)
-            os.remove(temp_file_path)
-        return temp_file_path
+            with open(self.manifest_path, 'r', encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+        for key in ("urls", "blobs"):
+            self.manifest.setdefault(key, {})
+        # 旧版本的 ETag 索引已不再使用
+        self.manifest.pop("etags", None)
+
+    def _save_manifest(self):
+        # 先写临时文件再替换，避免进程崩溃时留下写了一半的索引
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, "blobs", digest[:2], digest)
+
+    def unpacked_path(self, digest):
+        return os.path.join(self.root, "unpacked", digest)
+
+    def _touch(self, digest):
+        self.manifest["blobs"][digest]["last_access"] = time.time()
+
+    def _valid_digest(self, digest):
+        """
+        digest 在索引中且磁盘上的文件大小一致时才认为可用。
+        """
+        blob = self.manifest["blobs"].get(digest)
+        if blob is None:
+            return False
+        path = self.blob_path(digest)
+        return os.path.isfile(path) and os.path.getsize(path) == blob["size"]
+
+    def lookup(self, fileurl):
+        """
+        查询 URL 是否已经缓存，命中时返回 digest，否则返回 None。
+        """
+        self._load_manifest()
+        entry = self.manifest["urls"].get(fileurl)
+        if entry and self._valid_digest(entry["digest"]):
+            self._touch(entry["digest"])
+            return entry["digest"]
+        return None
+
+    def acquire(self, digest):
+        """
+        占用 digest，直到对应的 release() 之前都不会被淘汰。内容已经不在缓存中时返回 False。
+        """
+        self._load_manifest()
+        if not self._valid_digest(digest):
+            return False
+        self.pins[digest] = self.pins.get(digest, 0) + 1
+        return True
+
+    def release(self, digest):
+        count = self.pins.get(digest, 0) - 1
+        if count > 0:
+            self.pins[digest] = count
+        else:
+            self.pins.pop(digest, None)
+
+    @contextlib.contextmanager
+    def pinned(self, digest):
+        """
+        在 with 块内占用 digest；digest 为 None 或已被淘汰时不占用。
+        """
+        acquired = digest is not None and self.acquire(digest)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self.release(digest)
+
+    async def fetch(self, fileurl):
+        """
+        返回 URL 对应内容的 digest；缓存未命中时下载并写入缓存。
+        """
+        async with self.lock:
+            digest = self.lookup(fileurl)
+            if digest is not None:
+                print(f"[ArtifactStore] 命中缓存: {fileurl} -> {digest}")
+                CACHE_REQUESTS.inc(cache="artifact_store", result="hit")
+                self._save_manifest()
+                return digest
+
+        tmp_path = os.path.join(self.root, "tmp", "%s.part" % hashlib.sha1(fileurl.encode("utf-8")).hexdigest())
+        start_time = time.perf_counter()
+        digest, etag, size = await self._download(fileurl, tmp_path)
+        CACHE_REQUESTS.inc(cache="artifact_store", result="miss")
+        elapsed = time.perf_counter() - start_time
+        DOWNLOAD_DURATION.observe(elapsed)
+        if elapsed > 0:
+            DOWNLOAD_THROUGHPUT.observe(size / elapsed)
+
+        async with self.lock:
+            if self._valid_digest(digest):
+                # 其他 URL 已经下载过相同内容
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(self.blob_path(digest)), exist_ok=True)
+                os.replace(tmp_path, self.blob_path(digest))
+                self.manifest["blobs"][digest] = {"size": size, "unpacked_size": 0, "last_access": time.time()}
+            self.manifest["urls"][fileurl] = {"digest": digest, "etag": etag}
+            self._touch(digest)
+            self._evict(keep=digest)
+            self._save_manifest()
+        return digest
+
+    async def _download(self, fileurl, tmp_path):
+        """
+        下载到临时文件并计算 SHA-256。
+        先用 HEAD 探测大小和 Accept-Ranges：支持分段且文件足够大时多连接并发分段下载（可断点续传），
+        否则退回单连接下载。
+
+        :return: (digest, etag, size)
+        """
+        session = _get_http_session()
+        try:
+            async with session.head(fileurl, allow_redirects=True, timeout=aiohttp.ClientTimeout(total=30)) as response:
+                probe_ok = response.status == 200
+                etag = response.headers.get("ETag")
+                size = response.content_length
+                accept_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"[ArtifactStore] HEAD 探测失败，使用单连接下载: {fileurl}: {str(e)}")
+            probe_ok = False
+
+        if probe_ok:
+            if accept_ranges and size and size >= RANGED_DOWNLOAD_MIN_SIZE:
+                try:
+                    await self._download_ranged(fileurl, tmp_path, size, etag)
+                    digest = await asyncio.get_running_loop().run_in_executor(None, _sha256_file, tmp_path)
+                    return digest, etag, size
+                except RangeNotSatisfiedError:
+                    # 声明了 Accept-Ranges 但实际忽略 Range 头返回整个文件，退回单连接下载
+                    print(f"[ArtifactStore] 服务器不支持分段下载，使用单连接下载: {fileurl}")
+                    for path in (tmp_path, tmp_path + ".progress"):
+                        if os.path.exists(path):
+                            os.remove(path)
+
+        try:
+            return await self._download_single(fileurl, tmp_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    async def _download_single(self, fileurl, tmp_path):
+        """
+        单连接顺序下载，边下载边计算 SHA-256。
+        """
+        session = _get_http_session()
+        async with session.get(fileurl, timeout=aiohttp.ClientTimeout(total=30*60)) as response:
+            if response.status != 200:
+                raise HTTPException(status_code=500, detail=f"Failed to download file from URL: {fileurl}")
+            etag = response.headers.get("ETag")
+            sha256 = hashlib.sha256()
+            size = 0
+            async with aiofiles.open(tmp_path, 'wb') as temp_f:
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    sha256.update(chunk)
+                    size += len(chunk)
+                    DOWNLOAD_BYTES.inc(len(chunk))
+                    await temp_f.write(chunk)
+            if response.content_length is not None and size != response.content_length:
+                raise Exception(f"Incomplete download from {fileurl}: {size}/{response.content_length} bytes")
+        print(f"[ArtifactStore] 文件下载完成: {fileurl} ({size} 字节)")
+        return sha256.hexdigest(), etag, size
+
+    async def _download_ranged(self, fileurl, tmp_path, size, etag):
+        """
+        把文件切成 RANGED_DOWNLOAD_CONNECTIONS 段，每段一个连接并发下载，用 os.pwrite 写入预分配文件的对应位置。
+        每段的进度记录在 <tmp_path>.progress 中，进程崩溃或下载失败后再次下载同一 URL 时从断点继续。
+        """
+        progress_path = tmp_path + ".progress"
+        progress = None
+        try:
+            with open(progress_path, 'r', encoding="utf-8") as f:
+                progress = json.load(f)
+        except (OSError, ValueError):
+            pass
+        if not progress or progress.get("url") != fileurl or progress.get("size") != size \
+                or progress.get("etag") != etag or not os.path.exists(tmp_path) or os.path.getsize(tmp_path) != size:
+            # 没有可用的进度信息（或远端文件已变化），重新开始
+            segment_size = -(-size // RANGED_DOWNLOAD_CONNECTIONS)
+            progress = {
+                "url": fileurl,
+                "size": size,
+                "etag": etag,
+                # 每段为 [起始偏移, 结束偏移(含), 已下载字节数]
+                "segments": [[start, min(start + segment_size, size) - 1, 0] for start in range(0, size, segment_size)]
+            }
+            with open(tmp_path, 'wb') as f:
+                f.truncate(size)
+        else:
+            done = sum(segment[2] for segment in progress["segments"])
+            print(f"[ArtifactStore] 断点续传: {fileurl} 已完成 {done}/{size} 字节")
+
+        def save_progress():
+            with open(progress_path + ".tmp", 'w', encoding="utf-8") as f:
+                json.dump(progress, f)
+            os.replace(progress_path + ".tmp", progress_path)
+
+        save_progress()
+        session = _get_http_session()
+        loop = asyncio.get_running_loop()
+        fd = os.open(tmp_path, os.O_WRONLY)
+        last_saved = [time.time()]
+
+        async def download_segment(segment):
+            start, end, done = segment
+            if start + done > end:
+                return
+            headers = {"Range": f"bytes={start + done}-{end}"}
+            async with session.get(fileurl, headers=headers, timeout=aiohttp.ClientTimeout(total=None, sock_read=60)) as response:
+                if response.status == 200:
+                    raise RangeNotSatisfiedError(fileurl)
+                if response.status != 206:
+                    raise HTTPException(status_code=500, detail=f"Failed to download range {headers['Range']} from URL: {fileurl}")
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    await loop.run_in_executor(None, os.pwrite, fd, chunk, start + segment[2])
+                    segment[2] += len(chunk)
+                    DOWNLOAD_BYTES.inc(len(chunk))
+                    if time.time() - last_saved[0] >= 1:
+                        save_progress()
+                        last_saved[0] = time.time()
+            if start + segment[2] != end + 1:
+                raise Exception(f"Incomplete range {start}-{end} from {fileurl}: {segment[2]} bytes")
+
+        try:
+            tasks = [asyncio.ensure_future(download_segment(segment)) for segment in progress["segments"]]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+        finally:
+            os.close(fd)
+            save_progress()
+        os.remove(progress_path)
+        print(f"[ArtifactStore] 分段下载完成: {fileurl} ({size} 字节, {len(progress['segments'])} 段)")
+
+    async def ensure_unpacked(self, digest, members=None):
+        """
+        确保 XAPK 中的指定文件已解压到 unpacked/<digest>，返回解压目录。
+        members 为 None 时解压全部文件；已经解压过的文件不会重复解压。
+        """
+        unpacked_dir = self.unpacked_path(digest)
+        loop = asyncio.get_running_loop()
+        start_time = time.perf_counter()
+        try:
+            extracted_size = await loop.run_in_executor(
+                None, _extract_zip_members, self.blob_path(digest), unpacked_dir, members
+            )
+        except KeyError as e:
+            raise HTTPException(status_code=500, detail=f"XAPK文件 '{digest}' 中缺少文件: {str(e)}")
+        except zipfile.BadZipFile as e:
+            print(f"XAPK解压失败: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"XAPK文件 '{digest}' 解压失败: {str(e)}")
+        if extracted_size:
+            XAPK_EXTRACT_DURATION.observe(time.perf_counter() - start_time)
+            async with self.lock:
+                blob = self.manifest["blobs"].get(digest)
+                if blob is not None:
+                    blob["unpacked_size"] = blob.get("unpacked_size", 0) + extracted_size
+                    self._evict(keep=digest)
+                    self._save_manifest()
+            print(f"XAPK解压成功！目录: {unpacked_dir}，本次解压 {extracted_size} 字节")
+        return unpacked_dir
+
+    def _evict(self, keep=None):
+        """
+        总大小超过预算时，按最近访问时间从旧到新淘汰（不会淘汰 keep 和正在占用的 digest）。
+        """
+        blobs = self.manifest["blobs"]
+        total = sum(blob["size"] + blob.get("unpacked_size", 0) for blob in blobs.values())
+        for digest in sorted(blobs, key=lambda d: blobs[d]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            if digest == keep or digest in self.pins:
+                continue
+            print(f"[ArtifactStore] 淘汰缓存: {digest}")
+            blob = blobs.pop(digest)
+            total -= blob["size"] + blob.get("unpacked_size", 0)
+            if os.path.exists(self.blob_path(digest)):
+                os.remove(self.blob_path(digest))
+            shutil.rmtree(self.unpacked_path(digest), ignore_errors=True)
+            for fileurl in [url for url, entry in self.manifest["urls"].items() if entry["digest"] == digest]:
+                del self.manifest["urls"][fileurl]
+
+
+artifact_store = ArtifactStore(ARTIFACT_STORE_DIR, ARTIFACT_STORE_MAX_BYTES)
+
+
+def _sha256_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _directory_size(path):
+    total = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            total += os.path.getsize(os.path.join(dir_path, file_name))
+    return total
+
+
+def _link_artifact(source_path, link_path):
+    """
+    在 link_path 创建指向缓存内容的软链接（原子替换已有的文件 / 链接）。
+    link_path 是真实目录时拒绝替换，/opt 是共享目录，重名的目录可能与本服务无关。
+    缓存被淘汰后链接失效，os.path.exists 会返回 False。
+    """
+    if os.path.isdir(link_path) and not os.path.islink(link_path):
+        raise HTTPException(status_code=409, detail=f"目标路径 '{link_path}' 是已存在的目录，拒绝覆盖，请先手动移除。")
+    tmp_link = f"{link_path}.{os.getpid()}.tmp"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(source_path, tmp_link)
+    os.replace(tmp_link, link_path)
+
+
+async def _single_flight(key, coro_factory):
+    """
+    合并同一 key 的并发调用：只有第一个调用真正执行 coro_factory()，其余调用等待同一个 Future。
+    成功时所有等待者拿到相同结果，失败时异常传播给所有等待者。
+    使用 shield，单个请求被取消（客户端断开）不会中断其他人在等待的下载。
+    """
+    future = _inflight_downloads.get(key)
+    if future is None:
+        future = asyncio.ensure_future(coro_factory())
+        _inflight_downloads[key] = future
+        future.add_done_callback(lambda _: _inflight_downloads.pop(key, None))
+    else:
+        SINGLE_FLIGHT_JOINED.inc(kind=key[0])
+        print(f"[_single_flight] 等待进行中的任务: {key}")
+    return await asyncio.shield(future)
 
 
-async def _process_downloaded_file(file_path: str):
+async def download_file(fileurl, temp_file_path, keep_pinned=False):
+    """
+    通过内容寻址缓存下载文件，并在 temp_file_path 目录下创建 <文件名> 的软链接（兼容原有目录结构）。
+    XAPK 会同时解压，并创建 <文件名去掉扩展名> 的目录链接。
+    keep_pinned 为 True 时返回后内容仍被占用（不会被淘汰），调用方用完后需要
+    artifact_store.release(os.path.basename(blob_path))。
+
+    :return: 缓存中的文件路径（内容不可变，可直接用于 adb push）
+    """
+    filename = __get_file_name_by_url(fileurl)
+    link_path = os.path.join(temp_file_path, filename)
+    while True:
+        # 同一 URL 的并发下载只执行一次；下载完成到这里之间内容可能已被其他下载淘汰，此时重新下载
+        digest = await _single_flight(("download", fileurl), lambda: artifact_store.fetch(fileurl))
+        if artifact_store.acquire(digest):
+            break
+        print(f"[download_file] 缓存在使用前已被淘汰，重新下载: {fileurl}")
+    try:
+        blob_path = artifact_store.blob_path(digest)
+        os.makedirs(temp_file_path, exist_ok=True)
+        _link_artifact(blob_path, link_path)
+        print(f"[download_file] {fileurl} -> {link_path} -> {blob_path}")
+        await _process_downloaded_file(link_path, digest)
+    except BaseException:
+        artifact_store.release(digest)
+        raise
+    if not keep_pinned:
+        artifact_store.release(digest)
+    return blob_path
+
+
+async def _process_downloaded_file(file_path: str, digest: str):
     """
     根据文件扩展名对下载的文件进行处理，例如解压XAPK文件。
     这是一个内部辅助函数。
@@ -420,37 +1649,368 @@ async def _process_downloaded_file(file_path: str):
     file_extension = file_extension.lower() # 转换为小写以进行统一比较
 
     if file_extension == '.xapk':
-        print(f"检测到XAPK文件: {file_path}，开始解压...")
-        # 定义解压的目标目录
-        # 目标目录名是原XAPK文件名不带扩展名
-        unzip_destination_dir = file_name_without_ext
-
-        # 构建unzip命令
-        # 我们使用 shell=True 来让 shell 处理通配符（尽管这里没有），并且执行命令
-        # 关键是设置 cwd 参数为文件所在的目录
-        # 为了安全和明确，unzip 命令直接使用完整的文件路径
-        unzip_command = ["unzip", "-o", file_path, "-d", unzip_destination_dir] # -o 选项表示覆盖现有文件
-
-        print(f"执行解压命令: {' '.join(unzip_command)}")
+        print(f"检测到XAPK文件: {file_path}，解压 manifest.json...")
+        # 下载后只解压 manifest.json，APK / OBB 在安装时按设备的 ABI / 屏幕密度按需解压
+        # 原来的解压目录（原XAPK文件名不带扩展名）改为指向缓存的链接
         try:
-            unzip_process = subprocess.run(
-                unzip_command,
-                cwd=os.path.dirname(file_path), # 设置工作目录为文件所在目录
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                check=True # 检查返回码，如果非零则抛出 CalledProcessError
+            all_members = await _list_xapk_members(digest)
+            if XAPK_MANIFEST in all_members:
+                members = [XAPK_MANIFEST]
+            else:
+                # 没有 manifest.json 时无法按需挑选，和原来一样把 APK 全部解压出来
+                members = [name for name in all_members if name.lower().endswith(".apk")]
+            unpacked_dir = await _single_flight(
+                ("unpack", digest, tuple(members)), lambda: artifact_store.ensure_unpacked(digest, members)
             )
-            print(f"XAPK解压成功！输出:\n{unzip_process.stdout.decode().strip()}")
-        except subprocess.CalledProcessError as e:
-            error_detail = e.stderr.decode().strip() if e.stderr else e.output.decode().strip()
-            print(f"XAPK解压失败 (返回码: {e.returncode}): {error_detail}")
-            raise HTTPException(status_code=500, detail=f"XAPK文件 '{file_path}' 解压失败: {error_detail}")
+            _link_artifact(unpacked_dir, file_name_without_ext)
+        except HTTPException:
+            raise
         except Exception as e:
             print(f"解压XAPK文件时发生未知错误: {str(e)}")
             raise HTTPException(status_code=500, detail=f"解压XAPK文件时发生错误: {str(e)}")
     else:
         print(f"文件 '{file_path}' 不是XAPK文件，无需解压。")
 
+
+def _extract_zip_members(zip_path, dest_dir, members=None):
+    """
+    使用 zipfile 流式解压指定文件（members 为 None 时解压全部），每个文件先写临时文件再 rename。
+    已存在且大小一致的文件跳过。在线程池中执行。
+
+    :return: 本次解压的字节数
+    """
+    extracted_size = 0
+    # 即使没有需要解压的文件也要创建目录，指向它的链接才不会悬空
+    os.makedirs(dest_dir, exist_ok=True)
+    real_dest = os.path.realpath(dest_dir)
+    with zipfile.ZipFile(zip_path) as zf:
+        infos = [zf.getinfo(name) for name in members] if members is not None else zf.infolist()
+        for info in infos:
+            if info.is_dir():
+                continue
+            target_path = os.path.realpath(os.path.join(dest_dir, info.filename))
+            # 防止 ../ 之类的路径写到解压目录之外
+            if not target_path.startswith(real_dest + os.sep):
+                raise zipfile.BadZipFile(f"非法的文件路径: {info.filename}")
+            if os.path.isfile(target_path) and os.path.getsize(target_path) == info.file_size:
+                continue
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix=".extract-", dir=os.path.dirname(target_path))
+            try:
+                with zf.open(info) as source, os.fdopen(fd, 'wb') as target:
+                    shutil.copyfileobj(source, target, DOWNLOAD_CHUNK_SIZE)
+                os.replace(tmp_path, target_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            extracted_size += info.file_size
+    return extracted_size
+
+
+async def _list_xapk_members(digest):
+    """
+    列出缓存中 XAPK 包含的所有文件名。
+    """
+    def list_members():
+        with zipfile.ZipFile(artifact_store.blob_path(digest)) as zf:
+            return [info.filename for info in zf.infolist() if not info.is_dir()]
+    return await asyncio.get_running_loop().run_in_executor(None, list_members)
+
+
+def _read_xapk_manifest(xapk_dir):
+    """
+    读取 XAPK 目录中的 manifest.json，不存在或无法解析时返回空字典。
+    """
+    try:
+        with open(os.path.join(xapk_dir, XAPK_MANIFEST), 'r', encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _select_split_apks(apk_files, abis, density):
+    """
+    根据设备的 ABI 列表和屏幕密度挑选需要安装的 split APK：
+    - ABI split（config.arm64_v8a 等）只保留设备 ABI 列表中最靠前的一个
+    - 密度 split（config.xxhdpi 等）只保留与设备密度最接近的一个（优先不低于设备密度）
+    - 其他 APK（base、语言包等）全部保留
+    设备信息未知或没有匹配项时保留该类全部 split，交给系统判断。
+    """
+    abi_splits, density_splits, selected = {}, {}, []
+    for apk_file in apk_files:
+        match = re.search(r"config\.([A-Za-z0-9_]+)\.apk$", os.path.basename(apk_file))
+        qualifier = match.group(1).lower() if match else None
+        if qualifier in ABI_SPLITS:
+            abi_splits[qualifier] = apk_file
+        elif qualifier in DENSITY_SPLITS:
+            density_splits[qualifier] = apk_file
+        else:
+            selected.append(apk_file)
+
+    if abi_splits:
+        matched_abi = next((abi for abi in abis if abi in abi_splits), None)
+        selected.extend([abi_splits[matched_abi]] if matched_abi else abi_splits.values())
+    if density_splits:
+        if density:
+            higher = [q for q in density_splits if DENSITY_SPLITS[q] >= density]
+            candidates = higher or list(density_splits)
+            best = min(candidates, key=lambda q: abs(DENSITY_SPLITS[q] - density))
+            selected.append(density_splits[best])
+        else:
+            selected.extend(density_splits.values())
+    return selected
+
+
+async def _get_device_profile(adb_serial):
+    """
+    查询设备支持的 ABI 列表和屏幕密度，结果缓存在连接管理器中。需要在持有设备连接时调用。
+    """
+    device = adb_manager.devices.get(adb_serial, {})
+    if device.get("profile"):
+        return device["profile"]
+    _, abilist, _ = await _run_adb("-s", adb_serial, "shell", "getprop", "ro.product.cpu.abilist", timeout=ADB_CONNECT_TIMEOUT)
+    _, density_output, _ = await _run_adb("-s", adb_serial, "shell", "wm", "density", timeout=ADB_CONNECT_TIMEOUT)
+    # wm density 输出形如 "Physical density: 480"，有 Override density 时以最后一行为准
+    densities = re.findall(r"density:\s*(\d+)", density_output)
+    profile = {
+        "abis": [abi.strip().replace("-", "_").lower() for abi in abilist.split(",") if abi.strip()],
+        "density": int(densities[-1]) if densities else None
+    }
+    device["profile"] = profile
+    return profile
+
+
+async def _install_xapk_on_device(ip, xapk_dir, digest=None):
+    """
+    在单台设备上安装 XAPK：按设备 ABI / 密度挑选 split APK，用 adb install-multiple 安装，
+    同时并发 push OBB 扩展文件。digest 不为空时 xapk_dir 是缓存中的解压目录，所需文件按需解压。
+
+    :return: {"apks": [...], "obbs": [...], "output": ...}
+    """
+    if digest is not None:
+        all_members = await _list_xapk_members(digest)
+        if XAPK_MANIFEST in all_members:
+            await _single_flight(
+                ("unpack", digest, (XAPK_MANIFEST,)), lambda: artifact_store.ensure_unpacked(digest, [XAPK_MANIFEST])
+            )
+    else:
+        all_members = [os.path.relpath(os.path.join(dir_path, name), xapk_dir)
+                       for dir_path, _, names in os.walk(xapk_dir) for name in names]
+    manifest = _read_xapk_manifest(xapk_dir)
+    if manifest.get("split_apks"):
+        apk_files = [split["file"] for split in manifest["split_apks"]]
+    else:
+        apk_files = sorted(name for name in all_members if os.sep not in name and name.lower().endswith(".apk"))
+    if not apk_files:
+        raise HTTPException(status_code=400, detail=f"XAPK '{xapk_dir}' 中没有APK文件。")
+    expansions = [item for item in manifest.get("expansions", []) if item.get("file")]
+
+    async with adb_manager.device(ip) as adb_serial:
+        profile = await _get_device_profile(adb_serial)
+        selected_apks = _select_split_apks(apk_files, profile["abis"], profile["density"])
+        if digest is not None:
+            needed = tuple(sorted(selected_apks + [item["file"] for item in expansions]))
+            await _single_flight(("unpack", digest, needed), lambda: artifact_store.ensure_unpacked(digest, list(needed)))
+
+        install_args = ["-s", adb_serial, "install-multiple", *selected_apks]
+        print(f"将在目录 '{xapk_dir}' 中执行的命令: adb {' '.join(install_args)}")
+        obb_pushes = [
+            _run_adb("-s", adb_serial, "push", os.path.join(xapk_dir, item["file"]),
+                     "/sdcard/" + item.get("install_path", item["file"]).lstrip("/"))
+            for item in expansions
+        ]
+        # install-multiple 和 OBB push 是相互独立的 adb 会话，可以并发执行
+        results = await asyncio.gather(_run_adb(*install_args, cwd=xapk_dir), *obb_pushes)
+
+    returncode, install_output, install_error = results[0]
+    if returncode != 0:
+        # 处理 adb 命令执行失败
+        error_detail = install_error or install_output
+        print(f"ADB 命令执行失败 (返回码: {returncode}): {error_detail}")
+        raise HTTPException(status_code=500, detail=f"ADB 命令执行失败 (返回码: {returncode}): {error_detail}")
+    if "Success" not in install_output:
+        # 如果安装失败，则抛出异常，并包含错误信息
+        raise HTTPException(status_code=500, detail=f"APK安装失败: {install_error if install_error else install_output}")
+    for item, (obb_returncode, _, obb_error) in zip(expansions, results[1:]):
+        if obb_returncode != 0:
+            raise HTTPException(status_code=500, detail=f"OBB文件 '{item['file']}' 推送失败: {obb_error}")
+
+    return {"apks": selected_apks, "obbs": [item["file"] for item in expansions], "output": install_output}
+
+
+def _store_digest_for_dir(xapk_dir):
+    """
+    如果目录是内容寻址缓存中的解压目录（或指向它的链接），返回对应的 digest，否则返回 None。
+    """
+    real_dir = os.path.realpath(xapk_dir)
+    unpacked_root = os.path.realpath(os.path.join(artifact_store.root, "unpacked"))
+    if os.path.dirname(real_dir) == unpacked_root and os.path.isfile(artifact_store.blob_path(os.path.basename(real_dir))):
+        return os.path.basename(real_dir)
+    return None
+
+class JobScheduler:
+    """
+    进程内的后台任务调度器：固定数量的 worker 按提交顺序执行任务，同一台设备同一时间只执行一个任务，
+    设备忙时 worker 跳过该任务先执行其他设备的任务。
+    配置了 journal_path 时任务状态写入 SQLite，重启后未完成的任务重新入队
+    （下载走内容寻址缓存、push / install 可以重复执行，所以重新执行是安全的）。
+    """
+
+    def __init__(self, workers, journal_path=None, history_limit=1000):
+        self.workers = workers
+        self.journal_path = journal_path
+        self.history_limit = history_limit
+        self.jobs = {}              # job_id -> job，按提交顺序
+        self.pending = []           # 等待执行的 job_id
+        self.busy_devices = set()
+        self.done_events = {}       # job_id -> asyncio.Event，任务结束时 set
+        self.condition = asyncio.Condition()
+        self.tasks = []
+        self.db = None
+
+    async def start(self):
+        if self.journal_path:
+            self._journal_open()
+            for job in self._journal_load():
+                self.jobs[job["id"]] = job
+                if job["state"] in ("queued", "running"):
+                    print(f"[JobScheduler] 恢复未完成的任务: {job['id']} ({job['kind']}, {job['device']})")
+                    job["state"] = "queued"
+                    job["progress"] = None
+                    self.pending.append(job["id"])
+                    self.done_events[job["id"]] = asyncio.Event()
+                    self._journal_write(job)
+        self.tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    async def submit(self, kind, params, device):
+        if kind not in JOB_HANDLERS:
+            raise HTTPException(status_code=400, detail=f"Unknown job kind: {kind}")
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "device": device,
+            "params": params,
+            "state": "queued",
+            "progress": None,
+            "result": None,
+            "error": None,
+            "status_code": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None
+        }
+        async with self.condition:
+            self.jobs[job["id"]] = job
+            self.pending.append(job["id"])
+            self.done_events[job["id"]] = asyncio.Event()
+            self._journal_write(job)
+            self.condition.notify_all()
+        return job
+
+    async def wait(self, job_id):
+        event = self.done_events.get(job_id)
+        if event is not None:
+            await event.wait()
+        return self.jobs[job_id]
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self, state=None, kind=None, device=None):
+        return [
+            job for job in self.jobs.values()
+            if (state is None or job["state"] == state)
+            and (kind is None or job["kind"] == kind)
+            and (device is None or job["device"] == device)
+        ]
+
+    def _next_runnable(self):
+        for job_id in self.pending:
+            if self.jobs[job_id]["device"] not in self.busy_devices:
+                return job_id
+        return None
+
+    async def _worker(self):
+        while True:
+            async with self.condition:
+                await self.condition.wait_for(lambda: self._next_runnable() is not None)
+                job_id = self._next_runnable()
+                self.pending.remove(job_id)
+                job = self.jobs[job_id]
+                self.busy_devices.add(job["device"])
+                job["state"] = "running"
+                job["started_at"] = time.time()
+                self._journal_write(job)
+
+            print(f"[JobScheduler] 开始执行任务: {job_id} ({job['kind']}, {job['device']})")
+            try:
+                job["result"] = await JOB_HANDLERS[job["kind"]](job)
+                job["state"] = "succeeded"
+            except asyncio.CancelledError:
+                # 服务关闭：保留 running 状态，重启后从日志中恢复
+                raise
+            except Exception as e:
+                job["state"] = "failed"
+                job["status_code"] = e.status_code if isinstance(e, HTTPException) else 500
+                job["error"] = e.detail if isinstance(e, HTTPException) else str(e)
+            finally:
+                async with self.condition:
+                    self.busy_devices.discard(job["device"])
+                    self.condition.notify_all()
+
+            job["finished_at"] = time.time()
+            JOBS_FINISHED.inc(kind=job["kind"], state=job["state"])
+            print(f"[JobScheduler] 任务结束: {job_id} {job['state']}，耗时 {job['finished_at'] - job['started_at']:.2f} 秒")
+            self._journal_write(job)
+            self.done_events.pop(job_id).set()
+            self._trim_history()
+
+    def _trim_history(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job["state"] in ("succeeded", "failed")]
+        for job_id in finished[:max(0, len(finished) - self.history_limit)]:
+            del self.jobs[job_id]
+            if self.db is not None:
+                self.db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        if self.db is not None:
+            self.db.commit()
+
+    def _journal_open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+        self.db = sqlite3.connect(self.journal_path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, created_at REAL, data TEXT)")
+        self.db.commit()
+
+    def _journal_load(self):
+        rows = self.db.execute("SELECT data FROM jobs ORDER BY created_at").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _journal_write(self, job):
+        if self.db is None:
+            return
+        self.db.execute(
+            "INSERT OR REPLACE INTO jobs (id, created_at, data) VALUES (?, ?, ?)",
+            (job["id"], job["created_at"], json.dumps(job, ensure_ascii=False))
+        )
+        self.db.commit()
+
+
+JOB_HANDLERS = {
+    "uploadfile_url": _upload_file_from_url_job,
+    "install_xapk_folder": _install_xapk_folder_job
+}
+job_scheduler = JobScheduler(JOB_WORKERS)
+
+
 def _get_config():
     env = os.getenv("APP_ENV", "dev")
     if env == "prod":
@@ -475,14 +2035,62 @@ def __get_file_name_by_url(url: str):
 # 读取配置并初始化全局变量
 def initialize_globals():
     config = _get_config()
-    global DOCKER_API_URLS, CLASH_PROXY_IP
+    global DOCKER_API_URLS, CLASH_PROXY_IP, DOCKER_FETCH_CONCURRENCY, DOCKER_FETCH_TIMEOUT, _docker_fetch_semaphore
+    global DOCKER_EVENTS_RECONNECT_DELAY, ADB_HEALTH_CHECK_INTERVAL, ADB_IDLE_TIMEOUT, UPLOAD_TEMP_DIR
+    global BROADCAST_PARALLELISM, ARTIFACT_STORE_DIR, ARTIFACT_STORE_MAX_BYTES, artifact_store
+    global RANGED_DOWNLOAD_MIN_SIZE, RANGED_DOWNLOAD_CONNECTIONS
+    global MODIFYDEV_TIMEOUT, MODIFYDEV_CONCURRENCY
+    global JOB_WORKERS, JOB_JOURNAL_PATH, JOB_HISTORY_LIMIT, job_scheduler
+    global HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST
     DOCKER_API_URLS = config.get("DOCKER_API_URLS", [])
     CLASH_PROXY_IP = config.get("CLASH_PROXY_IP", "")
+    DOCKER_FETCH_CONCURRENCY = config.get("DOCKER_FETCH_CONCURRENCY", DOCKER_FETCH_CONCURRENCY)
+    DOCKER_FETCH_TIMEOUT = config.get("DOCKER_FETCH_TIMEOUT", DOCKER_FETCH_TIMEOUT)
+    DOCKER_EVENTS_RECONNECT_DELAY = config.get("DOCKER_EVENTS_RECONNECT_DELAY", DOCKER_EVENTS_RECONNECT_DELAY)
+    ADB_HEALTH_CHECK_INTERVAL = config.get("ADB_HEALTH_CHECK_INTERVAL", ADB_HEALTH_CHECK_INTERVAL)
+    ADB_IDLE_TIMEOUT = config.get("ADB_IDLE_TIMEOUT", ADB_IDLE_TIMEOUT)
+    UPLOAD_TEMP_DIR = config.get("UPLOAD_TEMP_DIR", UPLOAD_TEMP_DIR)
+    BROADCAST_PARALLELISM = config.get("BROADCAST_PARALLELISM", BROADCAST_PARALLELISM)
+    ARTIFACT_STORE_DIR = config.get("ARTIFACT_STORE_DIR", ARTIFACT_STORE_DIR)
+    ARTIFACT_STORE_MAX_BYTES = config.get("ARTIFACT_STORE_MAX_BYTES", ARTIFACT_STORE_MAX_BYTES)
+    RANGED_DOWNLOAD_MIN_SIZE = config.get("RANGED_DOWNLOAD_MIN_SIZE", RANGED_DOWNLOAD_MIN_SIZE)
+    RANGED_DOWNLOAD_CONNECTIONS = config.get("RANGED_DOWNLOAD_CONNECTIONS", RANGED_DOWNLOAD_CONNECTIONS)
+    MODIFYDEV_TIMEOUT = config.get("MODIFYDEV_TIMEOUT", MODIFYDEV_TIMEOUT)
+    HTTP_POOL_LIMIT = config.get("HTTP_POOL_LIMIT", HTTP_POOL_LIMIT)
+    HTTP_POOL_LIMIT_PER_HOST = config.get("HTTP_POOL_LIMIT_PER_HOST", HTTP_POOL_LIMIT_PER_HOST)
+    MODIFYDEV_CONCURRENCY = config.get("MODIFYDEV_CONCURRENCY", MODIFYDEV_CONCURRENCY)
+    JOB_WORKERS = config.get("JOB_WORKERS", JOB_WORKERS)
+    JOB_JOURNAL_PATH = config.get("JOB_JOURNAL_PATH", JOB_JOURNAL_PATH)
+    JOB_HISTORY_LIMIT = config.get("JOB_HISTORY_LIMIT", JOB_HISTORY_LIMIT)
+    artifact_store = ArtifactStore(ARTIFACT_STORE_DIR, ARTIFACT_STORE_MAX_BYTES)
+    job_scheduler = JobScheduler(JOB_WORKERS, JOB_JOURNAL_PATH, JOB_HISTORY_LIMIT)
+    _docker_fetch_semaphore = asyncio.Semaphore(DOCKER_FETCH_CONCURRENCY)
 
 # FastAPI 启动时调用初始化函数
 @app.on_event("startup")
 async def startup():
+    global _adb_eviction_task
     initialize_globals()
+    _adb_eviction_task = asyncio.ensure_future(_adb_idle_eviction_loop())
+    await job_scheduler.start()
+    # 每个 Docker 主机启动一个事件流订阅任务
+    if not DOCKER_API_URLS:
+        _container_index_ready.set()
+    for docker_api_url in DOCKER_API_URLS:
+        _docker_watch_tasks.append(asyncio.ensure_future(_watch_docker_events(docker_api_url)))
+
+# FastAPI 关闭时释放共享的 HTTP 连接池
+@app.on_event("shutdown")
+async def shutdown():
+    for task in _docker_watch_tasks:
+        task.cancel()
+    if _adb_eviction_task is not None:
+        _adb_eviction_task.cancel()
+    await job_scheduler.stop()
+    await adb_manager.close()
+    for session in (_http_session, _events_session):
+        if session is not None and not session.closed:
+            await session.close()
 
 
 def main():
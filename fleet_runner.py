@@ -0,0 +1,947 @@
+"""
+云机集群批量操作：一份主机清单 + 可扩展的操作注册表，用线程池并发执行，
+对 rdcpc3 控制端按目标限速，所有操作共用同一套重试 / 退避策略。
+remove_phone_1/2/3/4/5/7 的 __main__ 都委托到这里；每次运行的结果写入 RUNS_DIR 下的 JSONL 运行日志，
+中断或部分失败后可以用 --resume / --only-failed 续跑，已成功的主机不会重复执行。
+
+用法示例:
+    python fleet_runner.py reset
+    python fleet_runner.py pull_image --workers 8 --rate 2
+    python fleet_runner.py vpc_get_list --hosts 192.168.150.3 192.168.150.4
+    python fleet_runner.py provision --stage-limit pull_image=4
+    python fleet_runner.py reset,pull_image
+    python fleet_runner.py --resume 20251020-153000-pull_image
+    python fleet_runner.py --only-failed
+    python fleet_runner.py pull_image --rollout --seed 2 --max-concurrency 12
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+BASE_URL = os.getenv("FLEET_BASE_URL", "http://rdcpc3.echoing.cc:10012")
+IMAGE_ADDR = os.getenv("FLEET_IMAGE_ADDR", "registry.cn-guangzhou.aliyuncs.com/mytos/dobox:Q12_base_202508141406")
+# 云机参数（remove_phone_4.py 使用）
+VM_SLOTS = 5
+VM_RESOLUTION = "1"
+VM_DNS = "8.8.8.8"
+VM_WIDTH = "1080"
+VM_HEIGHT = "1920"
+VM_CREATE_PER_HOST = 5        # 单台主机同时创建的云机数
+VM_CREATE_GLOBAL = 16         # 所有主机合计同时创建的云机数
+VM_READY_TIMEOUT = 300        # 等待云机可启动 / 已运行的最长时间（秒）
+VM_POLL_INITIAL = 0.5         # 轮询 /get/{ip} 的初始间隔，之后翻倍
+VM_POLL_MAX = 8.0
+VM_NOT_READY_STATES = {"creating", "pending", "pulling"}
+VM_RUNNING_STATES = {"running"}
+# 镜像分批下发（pull_image --rollout）
+ROLLOUT_SEED = 2              # 第一批（种子批次）的主机数
+ROLLOUT_INITIAL = 4           # 种子批次之后的初始并发
+ROLLOUT_MIN = 1
+ROLLOUT_MAX = 16
+ROLLOUT_SLOWDOWN = 1.5        # 单台耗时超过种子批次中位数的这个倍数，认为上行带宽 / 仓库已饱和
+DEFAULT_WORKERS = 16
+DEFAULT_RATE = 5.0   # 对同一个控制端每秒最多发起的请求数
+DEFAULT_BURST = 5
+RUNS_DIR = os.getenv("FLEET_RUNS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fleet_runs"))
+
+# ========== 39 台主机的清单 ==========
+HOSTS = [
+    "192.168.150.3",
+    "192.168.150.4",
+    "192.168.150.5",
+    "192.168.150.6",
+    "192.168.150.7",
+    "192.168.150.8",
+    "192.168.150.9",
+    "192.168.150.10",
+    "192.168.150.12",
+    "192.168.150.13",
+    "192.168.150.14",
+    "192.168.150.15",
+    "192.168.150.16",
+    "192.168.150.17",
+    "192.168.150.18",
+    "192.168.150.19",
+    "192.168.150.21",
+    "192.168.150.22",
+    "192.168.150.23",
+    "192.168.150.24",
+    "192.168.150.25",
+    "192.168.150.26",
+    "192.168.150.28",
+    "192.168.150.30",
+    "192.168.150.31",
+    "192.168.150.32",
+    "192.168.150.33",
+    "192.168.150.34",
+    "192.168.150.35",
+    "192.168.150.36",
+    "192.168.150.37",
+    "192.168.150.40",
+    "192.168.150.41",
+    "192.168.150.42",
+    "192.168.150.43",
+    "192.168.150.44",
+    "192.168.150.45",
+    "192.168.150.46",
+    "192.168.150.47"
+]
+
+logger = logging.getLogger("fleet_runner")
+
+
+def load_hosts(path=None):
+    """
+    读取主机清单：指定文件（或环境变量 FLEET_HOSTS_FILE）时每行一个 IP，# 开头为注释，否则使用内置清单。
+    """
+    path = path or os.getenv("FLEET_HOSTS_FILE")
+    if not path:
+        return list(HOSTS)
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
+
+
+# ------------------- 限速 / 重试 -------------------
+class RateLimiter:
+    """
+    令牌桶限速，线程安全。rate 为每秒令牌数，burst 为桶容量。
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RetryPolicy:
+    """
+    指数退避 + 随机抖动：第 n 次重试前等待 min(max_delay, base_delay * 2^(n-1)) 的 50%~100%，
+    抖动避免大量主机同时失败后又同时重试。
+    """
+
+    def __init__(self, max_retries=3, base_delay=1.0, max_delay=30.0, retry_statuses=(429, 500, 502, 503, 504)):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = set(retry_statuses)
+
+    def with_retries(self, max_retries):
+        return RetryPolicy(max_retries, self.base_delay, self.max_delay, self.retry_statuses)
+
+    def backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+
+class FleetClient:
+    """
+    共享的 HTTP 客户端：连接池按并发数配置，每个目标（host:port）一个限速器，请求失败按重试策略退避。
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, rate=DEFAULT_RATE, burst=DEFAULT_BURST, retry_policy=None):
+        self.session = requests.Session()
+        # 连接池按实际的并发峰值配置：create_vms 在每个主机线程之外还会并发创建云机，
+        # 池子小于并发数时多出来的连接用完就被丢弃（urllib3 的 "Connection pool is full"）
+        pool_size = max(workers + min(workers * VM_CREATE_PER_HOST, VM_CREATE_GLOBAL), 10)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.rate = rate
+        self.burst = burst
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.limiters = {}
+        self.limiters_lock = threading.Lock()
+
+    def limiter_for(self, url):
+        target = urlparse(url).netloc
+        with self.limiters_lock:
+            limiter = self.limiters.get(target)
+            if limiter is None:
+                limiter = self.limiters[target] = RateLimiter(self.rate, self.burst)
+            return limiter
+
+    def request(self, method, url, ok_statuses=(200,), timeout=300, max_retries=None, connect_only=False, **kwargs):
+        """
+        发送请求，状态码在 ok_statuses 中时返回 (response, 尝试次数)。
+        超时、连接失败以及 retry_statuses 中的状态码会退避后重试，其他状态码直接失败。
+        connect_only=True 用于不幂等的请求：只有连接没建立起来（请求肯定没发出去）时才重试，
+        读超时、响应中途断开以及任何状态码都不重试，避免控制端把同一个命令执行两次。
+        """
+        policy = self.retry_policy if max_retries is None else self.retry_policy.with_retries(max_retries)
+        limiter = self.limiter_for(url)
+        attempt = 0
+        while True:
+            attempt += 1
+            limiter.acquire()
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+                if response.status_code in ok_statuses:
+                    return response, attempt
+                error = FleetError(f"HTTP {response.status_code} {response.reason}", response.status_code)
+                retryable = not connect_only and response.status_code in policy.retry_statuses
+            except requests.exceptions.ConnectTimeout:
+                error, retryable = FleetError("连接超时"), True
+            except requests.exceptions.Timeout:
+                error, retryable = FleetError("请求超时"), not connect_only
+            except requests.exceptions.ConnectionError as e:
+                error, retryable = FleetError(f"连接失败: {e}"), not connect_only or _is_connect_failure(e)
+            if not retryable or attempt > policy.max_retries:
+                error.attempts = attempt
+                raise error
+            backoff = policy.backoff(attempt)
+            logger.info(f"{method} {url} {error}，{backoff:.1f} 秒后重试 ({attempt}/{policy.max_retries})")
+            time.sleep(backoff)
+
+
+def _is_connect_failure(error):
+    """
+    判断 ConnectionError 是否发生在建立连接阶段（DNS 解析失败、连接被拒绝等），此时请求还没有发出去。
+    """
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+class FleetError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+        self.attempts = 1
+
+
+# ------------------- 操作注册表 -------------------
+OPERATIONS = {}
+
+
+def operation(name, description=""):
+    """
+    注册一个主机级操作。被装饰的函数签名为 func(client, ip)，返回结果说明（字符串或字典），失败时抛出异常。
+    """
+    def decorator(func):
+        func.operation_name = name
+        func.description = description
+        OPERATIONS[name] = func
+        return func
+    return decorator
+
+
+@operation("reset", "重置主机")
+def reset(client, ip):
+    response, _ = client.request("GET", f"{BASE_URL}/host_api/v1/reset/{ip}", max_retries=0)
+    return f"{response.status_code} {response.reason}"
+
+
+@operation("pull_image", "拉取并导入镜像")
+def pull_image(client, ip, image_addr=None):
+    response, _ = client.request(
+        "POST", f"{BASE_URL}/dc_api/v1/pull_image2/{ip}",
+        params={"image_addr": image_addr or IMAGE_ADDR},
+        ok_statuses=(200, 201, 202), timeout=600, max_retries=5
+    )
+    return f"{response.status_code} {response.reason}"
+
+
+@operation("install_sdk", "安装 SDK")
+def install_sdk(client, ip):
+    # 控制端对已安装的主机也返回 200，响应内容就是安装结果
+    response, _ = client.request(
+        "GET", f"{BASE_URL}/host_api/v1/install_sdk", params={"ip_list": ip},
+        ok_statuses=range(100, 600), max_retries=0
+    )
+    return f"[{response.status_code}] {response.text.strip()}"
+
+
+@operation("reboot", "重启主机")
+def reboot(client, ip):
+    response, _ = client.request("GET", f"{BASE_URL}/host_api/v1/reboot_host/{ip}", max_retries=0)
+    return f"{response.status_code} {response.reason}"
+
+
+@operation("vpc_get_list", "获取主机的 VPC 列表")
+def vpc_get_list(client, ip):
+    response, _ = client.request("GET", f"{BASE_URL}/dc_api/v1/vpc_get_list/{ip}", max_retries=2)
+    try:
+        return response.json()
+    except ValueError:
+        return response.text.strip()
+
+
+_vm_create_slots = threading.BoundedSemaphore(VM_CREATE_GLOBAL)
+
+
+def set_vm_limits(per_host=None, global_limit=None):
+    global VM_CREATE_PER_HOST, VM_CREATE_GLOBAL, _vm_create_slots
+    if per_host:
+        VM_CREATE_PER_HOST = per_host
+    if global_limit:
+        VM_CREATE_GLOBAL = global_limit
+        _vm_create_slots = threading.BoundedSemaphore(global_limit)
+
+
+def desired_vm_slots(ip):
+    """期望的云机布局：槽位 1~VM_SLOTS，名称为 {ip}T100{i}。"""
+    return {f"{ip}T100{i}": i for i in range(1, VM_SLOTS + 1)}
+
+
+def fetch_vms(client, ip):
+    """
+    返回 ({云机名: 状态}, 无法识别名称的条目数)，控制端没有返回状态字段时状态为 None。
+    """
+    response, _ = client.request("GET", f"{BASE_URL}/get/{ip}", ok_statuses=(200, 201, 202), max_retries=5)
+    vms = {}
+    unrecognized = 0
+    for vm in response.json().get("msg") or []:
+        name = state = None
+        if isinstance(vm, dict):
+            name = vm.get("name") or vm.get("custom_tag")
+            state = vm.get("state") or vm.get("status")
+        if name:
+            vms[name] = state.lower() if isinstance(state, str) else None
+        else:
+            unrecognized += 1
+    return vms, unrecognized
+
+
+def create_vm(client, ip, slot, name, image_addr=None):
+    with _vm_create_slots:
+        client.request(
+            "POST", f"{BASE_URL}/dc_api/v1/create/{ip}/{slot}/{name}",
+            params={
+                "image_addr": image_addr or IMAGE_ADDR,
+                "resolution": VM_RESOLUTION,
+                "width": VM_WIDTH,
+                "height": VM_HEIGHT,
+                "custom_tag": name,
+                "dns": VM_DNS
+            },
+            ok_statuses=(200, 201, 202), max_retries=5
+        )
+    return name
+
+
+@operation("create_vms", "创建并启动云机实例")
+def create_vms(client, ip, image_addr=None):
+    """
+    对比期望的 5 个槽位和 /get/{ip} 的现状，只创建缺失的槽位（单机和全局各有并发上限），
+    然后轮询 /get/{ip}（间隔指数增长）：云机一就绪就启动，直到全部处于运行状态。
+    已存在但没在运行的云机也会被启动。
+    """
+    desired = desired_vm_slots(ip)
+    existing, unrecognized = fetch_vms(client, ip)
+    if unrecognized:
+        # 认不出已有云机对应哪个槽位时不能按槽位补建，只能按数量判断，避免重复创建
+        total = len(existing) + unrecognized
+        if total >= VM_SLOTS:
+            return f"已有 {total} 个实例（{unrecognized} 个无法识别名称），跳过创建"
+        raise FleetError(f"/get/{ip} 返回的 {unrecognized} 个实例无法识别名称，共 {total} 个，不足 {VM_SLOTS} 个，拒绝盲目创建")
+    missing = [name for name in desired if name not in existing]
+    to_run = {name for name in desired if name in existing
+              and existing[name] is not None and existing[name] not in VM_RUNNING_STATES}
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(VM_CREATE_PER_HOST, len(missing))) as executor:
+            futures = [executor.submit(create_vm, client, ip, desired[name], name, image_addr) for name in missing]
+            for future in as_completed(futures):
+                logger.info(f"{ip} 已提交创建 {future.result()}")
+        to_run.update(missing)
+    if not to_run:
+        return f"{len(existing)} 个槽位均已就绪，无需创建"
+
+    deadline = time.monotonic() + VM_READY_TIMEOUT
+    delay = VM_POLL_INITIAL
+    started, confirming = [], set()
+    pending = set(to_run)
+    while True:
+        vms, _ = fetch_vms(client, ip)
+        for name in sorted(pending):
+            if name in vms and vms[name] not in VM_NOT_READY_STATES:
+                client.request("GET", f"{BASE_URL}/run/{ip}/{name}", ok_statuses=(200, 201, 202), max_retries=5)
+                pending.discard(name)
+                started.append(name)
+                confirming.add(name)
+        # 控制端不返回状态时无法确认，启动请求成功即视为完成
+        confirming = {name for name in confirming if vms.get(name) is not None and vms[name] not in VM_RUNNING_STATES}
+        if not pending and not confirming:
+            break
+        if time.monotonic() >= deadline:
+            raise FleetError(f"等待云机就绪超时: 未启动 {sorted(pending)}，未运行 {sorted(confirming)}")
+        time.sleep(delay)
+        delay = min(delay * 2, VM_POLL_MAX)
+    return f"已有 {len(existing)} 个，新建 {len(missing)} 个，启动 {len(started)} 个"
+
+
+# ------------------- 流水线 -------------------
+class Stage:
+    """
+    流水线中的一个阶段：operation 是注册表中的操作名，after 是依赖的阶段（默认依赖上一个阶段），
+    limit 是该阶段在所有主机上同时执行的上限（None 表示不单独限制）。
+    """
+
+    def __init__(self, name, operation=None, after=None, limit=None):
+        self.name = name
+        self.operation = operation or name
+        self.after = after
+        self.limit = limit
+
+
+# 新主机上线：重置 → 拉镜像 → 安装 SDK → 创建云机。拉镜像最占带宽，默认最多 4 台同时拉
+PIPELINES = {
+    "provision": [
+        Stage("reset"),
+        Stage("pull_image", limit=4),
+        Stage("install_sdk"),
+        Stage("create_vms"),
+    ]
+}
+
+
+def resolve_stages(stages):
+    """补全默认依赖并按依赖关系排序（拓扑排序），检查未知的操作和循环依赖。"""
+    by_name = {}
+    previous = None
+    for stage in stages:
+        if stage.operation not in OPERATIONS:
+            raise ValueError(f"未知的操作: {stage.operation}")
+        if stage.after is None:
+            stage.after = [previous] if previous else []
+        by_name[stage.name] = stage
+        previous = stage.name
+    ordered, visiting, done = [], set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"流水线存在循环依赖: {name}")
+        if name not in by_name:
+            raise ValueError(f"未知的依赖阶段: {name}")
+        visiting.add(name)
+        for dependency in by_name[name].after:
+            visit(dependency)
+        visiting.discard(name)
+        done.add(name)
+        ordered.append(by_name[name])
+
+    for stage in stages:
+        visit(stage.name)
+    return ordered
+
+
+def run_host_pipeline(client, stages, semaphores, ip, on_result=None, done=None):
+    """
+    单台主机按依赖顺序执行各阶段，阶段之间不等待其他主机；依赖失败的阶段跳过，
+    done(ip, 阶段名) 为真的阶段（续跑时上次已成功）直接视为成功。
+    """
+    start_time = time.time()
+    outcomes = {}
+    host_result = {"host": ip, "stages": []}
+    for stage in stages:
+        failed_dependencies = [name for name in stage.after if not outcomes.get(name)]
+        if done and done(ip, stage.name):
+            outcomes[stage.name] = True
+            host_result["stages"].append({"host": ip, "operation": stage.operation, "stage": stage.name,
+                                          "ok": True, "resumed": True, "detail": "上次运行已完成", "elapsed": 0})
+            continue
+        if failed_dependencies:
+            result = {"host": ip, "operation": stage.operation, "stage": stage.name, "ok": False,
+                      "skipped": True, "error": f"依赖的阶段失败: {', '.join(failed_dependencies)}", "elapsed": 0}
+        else:
+            with semaphores[stage.name]:
+                result = run_on_host(client, OPERATIONS[stage.operation], ip)
+            result["stage"] = stage.name
+        outcomes[stage.name] = result["ok"]
+        host_result["stages"].append(result)
+        if on_result:
+            on_result(result)
+    host_result["ok"] = all(outcomes.values())
+    host_result["elapsed"] = round(time.time() - start_time, 3)
+    return host_result
+
+
+def run_pipeline(stages, hosts=None, workers=DEFAULT_WORKERS, client=None, stage_limits=None, on_result=None,
+                 done=None):
+    """
+    每台主机独立地走完整条流水线：A 主机在创建云机时 B 主机可以还在拉镜像。
+    workers 限制同时处理的主机数，stage_limits（或 Stage.limit）限制单个阶段的并发。
+    总耗时约等于最慢那台主机的关键路径，而不是各阶段耗时之和。
+    done(ip, 阶段名) 为真的阶段不再执行。
+    """
+    stages = resolve_stages(stages)
+    hosts = hosts if hosts is not None else load_hosts()
+    client = client or FleetClient(workers=workers)
+    stage_limits = stage_limits or {}
+    semaphores = {}
+    for stage in stages:
+        limit = stage_limits.get(stage.name, stage.limit) or workers
+        semaphores[stage.name] = threading.BoundedSemaphore(limit)
+
+    def log_stage(result):
+        if result.get("skipped"):
+            logger.warning(f"跳过: {result['host']} {result['stage']} → {result['error']}")
+        elif result["ok"]:
+            logger.info(f"完成: {result['host']} {result['stage']} → {result['detail']} ({result['elapsed']}s)")
+        else:
+            logger.error(f"失败: {result['host']} {result['stage']} → {result['error']} ({result['elapsed']}s)")
+        if on_result:
+            on_result(result)
+
+    start_time = time.time()
+    logger.info(f"开始在 {len(hosts)} 台主机上执行流水线: {' → '.join(stage.name for stage in stages)}，"
+                f"并发主机 {workers}，阶段并发 {({name: sem._initial_value for name, sem in semaphores.items()})}")
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_host_pipeline, client, stages, semaphores, ip, log_stage, done) for ip in hosts]
+        for future in _as_completed_interruptible(executor, futures):
+            results.append(future.result())
+    success = sum(1 for result in results if result["ok"])
+    logger.info(f"流水线完成，耗时 {time.time() - start_time:.1f} 秒 | 全部成功: {success} 台 | 有失败: {len(results) - success} 台")
+    return results
+
+
+# ------------------- 运行日志（断点续跑） -------------------
+class RunJournal:
+    """
+    追加写的 JSONL 运行日志，每次运行一个文件 RUNS_DIR/<run_id>.jsonl。
+    第一行是运行信息（操作、主机清单），之后每完成一个主机的一个操作 / 阶段追加一行结果，
+    写完立即 fsync，进程崩溃或被 Ctrl-C 中断时已完成的记录不会丢。
+    """
+
+    def __init__(self, run_id, directory=None):
+        self.run_id = run_id
+        self.path = os.path.join(directory or RUNS_DIR, f"{run_id}.jsonl")
+        self.lock = threading.Lock()
+        self.header = None
+        self.outcomes = {}  # (host, 阶段名) -> 最近一次的结果
+        self.partial_line = False
+        if os.path.exists(self.path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            content = f.read()
+        # 中断时最后一行可能只写了一半，先补换行，后续追加的记录才不会接在残行后面
+        self.partial_line = bool(content) and not content.endswith("\n")
+        for line in content.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("type") == "run":
+                self.header = record
+            elif record.get("type") == "result":
+                self.outcomes[(record["host"], record.get("stage") or record["operation"])] = record
+
+    def _append(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                if self.partial_line:
+                    f.write("\n")
+                    self.partial_line = False
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def start(self, operation, hosts, options=None):
+        """options 是续跑时需要还原的运行方式（如 rollout），写在第一行运行信息里。"""
+        if self.header is None:
+            self.header = {"type": "run", "run_id": self.run_id, "operation": operation,
+                           "options": options or {}, "hosts": list(hosts), "started_at": time.time()}
+            self._append(self.header)
+        else:
+            self._append({"type": "resume", "run_id": self.run_id, "hosts": list(hosts), "started_at": time.time()})
+
+    def record(self, result):
+        record = dict(result, type="result", finished_at=time.time())
+        self.outcomes[(result["host"], result.get("stage") or result["operation"])] = record
+        self._append(record)
+
+    def completed(self, host, stage):
+        outcome = self.outcomes.get((host, stage))
+        return bool(outcome and outcome["ok"])
+
+    def failed_hosts(self):
+        """上次运行中有操作 / 阶段失败或被跳过的主机（按原清单顺序）。"""
+        failed = {host for (host, _), outcome in self.outcomes.items() if not outcome["ok"]}
+        return [host for host in self.header["hosts"] if host in failed]
+
+
+def new_run_id(operation):
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{operation.replace(',', '+')}"
+
+
+def latest_run_id(directory=None):
+    """
+    最近开始的一次运行。按运行信息里的 started_at 比较（--run-id 可以自定义，文件名不一定按时间排序），
+    读不到运行信息时用文件修改时间。
+    """
+    directory = directory or RUNS_DIR
+    names = [name for name in os.listdir(directory) if name.endswith(".jsonl")] if os.path.isdir(directory) else []
+    if not names:
+        raise ValueError(f"{directory} 下没有运行日志")
+
+    def started_at(name):
+        path = os.path.join(directory, name)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                header = json.loads(f.readline())
+            return float(header["started_at"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return os.path.getmtime(path)
+
+    return max(names, key=started_at)[:-len(".jsonl")]
+
+
+def _as_completed_interruptible(executor, futures):
+    """
+    按完成顺序产出 future；Ctrl-C 时取消还没开始的任务，已在执行的请求跑完后再退出，
+    这样运行日志里记录的状态和主机上的实际状态一致。
+    """
+    try:
+        yield from as_completed(futures)
+    except KeyboardInterrupt:
+        logger.warning("收到中断，取消未开始的任务，等待进行中的任务结束...")
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+
+
+# ------------------- 执行 -------------------
+def run_on_host(client, op, ip):
+    start_time = time.time()
+    result = {"host": ip, "operation": op.operation_name}
+    try:
+        result["detail"] = op(client, ip)
+        result["ok"] = True
+    except FleetError as e:
+        result.update(ok=False, error=str(e), status=e.status, attempts=e.attempts)
+    except Exception as e:
+        result.update(ok=False, error=f"{type(e).__name__}: {e}")
+    result["elapsed"] = round(time.time() - start_time, 3)
+    return result
+
+
+def run_operation(name, hosts=None, workers=DEFAULT_WORKERS, client=None, on_result=None, done=None):
+    """
+    在所有主机上并发执行一个已注册的操作，返回所有主机的结果列表。
+    总耗时约等于最慢的那台主机（受 workers 和限速约束）。done(ip, 操作名) 为真的主机跳过。
+    on_result 在工作线程里回调（和 run_pipeline 一样），中断时进行中的主机结果也不会漏掉，回调需要线程安全。
+    """
+    if name not in OPERATIONS:
+        raise ValueError(f"未知的操作: {name}，可用: {', '.join(OPERATIONS)}")
+    op = OPERATIONS[name]
+    hosts = hosts if hosts is not None else load_hosts()
+    if done:
+        pending = [ip for ip in hosts if not done(ip, name)]
+        if len(pending) < len(hosts):
+            logger.info(f"{len(hosts) - len(pending)} 台主机上次运行已完成 {name}，跳过")
+        hosts = pending
+    client = client or FleetClient(workers=workers)
+    results = []
+    start_time = time.time()
+    logger.info(f"开始在 {len(hosts)} 台主机上执行 {name}（{op.description}），并发 {workers}")
+    def run_and_report(ip):
+        result = run_on_host(client, op, ip)
+        if on_result:
+            on_result(result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_and_report, ip) for ip in hosts]
+        for index, future in enumerate(_as_completed_interruptible(executor, futures), 1):
+            result = future.result()
+            results.append(result)
+            if result["ok"]:
+                logger.info(f"[{index}/{len(hosts)}] 成功: {result['host']} → {result['detail']} ({result['elapsed']}s)")
+            else:
+                logger.error(f"[{index}/{len(hosts)}] 失败: {result['host']} → {result['error']} ({result['elapsed']}s)")
+    success = sum(1 for result in results if result["ok"])
+    logger.info(f"{name} 完成，耗时 {time.time() - start_time:.1f} 秒 | 成功: {success} 台 | 失败: {len(results) - success} 台")
+    return results
+
+
+# ------------------- 镜像分批下发 -------------------
+def image_in_inventory(inventory, image_addr):
+    """
+    在 vpc_get_list 的返回里查找镜像：任意层级的字符串字段包含完整镜像地址（或 @sha256 摘要）即视为已存在。
+    """
+    targets = [image_addr]
+    if "@" in image_addr:
+        targets.append(image_addr.split("@", 1)[1])
+    if isinstance(inventory, dict):
+        return any(image_in_inventory(value, image_addr) for value in inventory.values())
+    if isinstance(inventory, list):
+        return any(image_in_inventory(value, image_addr) for value in inventory)
+    return isinstance(inventory, str) and any(target in inventory for target in targets)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD 并发控制：以种子批次的单台耗时中位数为基准，
+    拉取按时完成时窗口每次加 1/窗口（大约每完成一整批加 1），
+    耗时超过基准的 ROLLOUT_SLOWDOWN 倍或出现超时 / 429 / 5xx 时窗口减半（一个基准耗时内最多减一次）。
+    单台耗时不变说明带宽还有余量，耗时随并发同比上涨说明已经饱和，再加并发只会拖慢所有主机。
+    """
+
+    def __init__(self, initial=ROLLOUT_INITIAL, minimum=ROLLOUT_MIN, maximum=ROLLOUT_MAX, slowdown=ROLLOUT_SLOWDOWN):
+        self.window = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.slowdown = slowdown
+        self.baseline = None
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    @property
+    def limit(self):
+        return max(self.minimum, min(self.maximum, int(self.window)))
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, elapsed, congested):
+        with self.condition:
+            self.in_flight -= 1
+            previous = self.limit
+            slow = self.baseline is not None and elapsed > self.baseline * self.slowdown
+            now = time.monotonic()
+            if congested or slow:
+                if now - self.last_decrease >= (self.baseline or 0):
+                    self.window = max(self.minimum, self.window / 2)
+                    self.last_decrease = now
+            else:
+                self.window = min(self.maximum, self.window + 1 / self.window)
+            if self.limit != previous:
+                logger.info(f"镜像拉取并发 {previous} → {self.limit}（单台耗时 {elapsed:.1f}s，基准 {self.baseline or 0:.1f}s）")
+            self.condition.notify_all()
+
+
+def rollout_image(hosts=None, image_addr=None, client=None, seed=ROLLOUT_SEED, initial=ROLLOUT_INITIAL,
+                  maximum=ROLLOUT_MAX, on_result=None, done=None):
+    """
+    分批下发镜像：
+    1. 并发查询各主机的 vpc_get_list，已经有该镜像的主机直接跳过；
+    2. 先拉种子批次（seed 台），全部失败就停止（镜像地址或仓库有问题，没必要让其余主机一起失败），
+       成功主机的耗时中位数作为基准；
+    3. 其余主机由 AdaptiveConcurrency 按观察到的耗时调整并发，既跑满上行带宽，又不压垮仓库和控制端。
+    """
+    image_addr = image_addr or IMAGE_ADDR
+    hosts = hosts if hosts is not None else load_hosts()
+    client = client or FleetClient(workers=maximum)
+    if done:
+        hosts = [ip for ip in hosts if not done(ip, "pull_image")]
+    start_time = time.time()
+    results = []
+
+    def finish(result):
+        results.append(result)
+        if result.get("skipped"):
+            logger.info(f"跳过: {result['host']} → {result['detail']}")
+        elif result["ok"]:
+            logger.info(f"成功: {result['host']} → {result['detail']} ({result['elapsed']}s)")
+        else:
+            logger.error(f"失败: {result['host']} → {result['error']} ({result['elapsed']}s)")
+        if on_result:
+            on_result(result)
+
+    def has_image(ip):
+        try:
+            return image_in_inventory(vpc_get_list(client, ip), image_addr)
+        except Exception as e:
+            logger.warning(f"{ip} 查询镜像清单失败（按未拉取处理）: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=min(maximum, max(1, len(hosts)))) as executor:
+        present = dict(zip(hosts, executor.map(has_image, hosts)))
+    pending = []
+    for ip in hosts:
+        if present[ip]:
+            finish({"host": ip, "operation": "pull_image", "ok": True, "skipped": True,
+                    "detail": "镜像已存在，跳过", "elapsed": 0})
+        else:
+            pending.append(ip)
+    logger.info(f"开始下发镜像 {image_addr}: {len(pending)} 台待拉取，{len(hosts) - len(pending)} 台已有镜像")
+
+    def pull_image_op(client, ip):
+        return pull_image(client, ip, image_addr)
+    pull_image_op.operation_name = "pull_image"
+
+    def pull(ip):
+        result = run_on_host(client, pull_image_op, ip)
+        finish(result)
+        return result
+
+    seed_hosts, rest = pending[:seed], pending[seed:]
+    with ThreadPoolExecutor(max_workers=max(1, len(seed_hosts))) as executor:
+        futures = [executor.submit(pull, ip) for ip in seed_hosts]
+        seed_results = [future.result() for future in _as_completed_interruptible(executor, futures)]
+    seed_times = sorted(result["elapsed"] for result in seed_results if result["ok"])
+    if seed_hosts and not seed_times:
+        for ip in rest:
+            finish({"host": ip, "operation": "pull_image", "ok": False, "skipped": True,
+                    "error": "种子批次全部失败，停止下发", "elapsed": 0})
+        rest = []
+
+    concurrency = AdaptiveConcurrency(initial=initial, maximum=maximum)
+    concurrency.baseline = seed_times[len(seed_times) // 2] if seed_times else None
+    if rest:
+        logger.info(f"种子批次完成，基准耗时 {concurrency.baseline or 0:.1f}s，其余 {len(rest)} 台从并发 {concurrency.limit} 开始")
+
+    def gated_pull(ip):
+        concurrency.acquire()
+        result = None
+        try:
+            result = pull(ip)
+        finally:
+            congested = result is None or (not result["ok"] and
+                                           (result.get("status") is None or result["status"] in client.retry_policy.retry_statuses))
+            concurrency.release(result["elapsed"] if result else 0, congested)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, min(maximum, len(rest)))) as executor:
+        futures = [executor.submit(gated_pull, ip) for ip in rest]
+        for _ in _as_completed_interruptible(executor, futures):
+            pass
+    success = sum(1 for result in results if result["ok"])
+    logger.info(f"镜像下发完成，耗时 {time.time() - start_time:.1f} 秒 | 成功: {success} 台 | 失败: {len(results) - success} 台")
+    return results
+
+
+def setup_logging(log_file=None):
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=handlers)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="云机集群批量操作")
+    parser.add_argument("operation", nargs="?", default=None,
+                        help=f"操作（{', '.join(sorted(OPERATIONS))}）、流水线（{', '.join(sorted(PIPELINES))}）"
+                             f"或逗号分隔的阶段列表（如 reset,pull_image）")
+    parser.add_argument("--hosts", nargs="+", default=None, help="只在这些主机上执行，默认使用完整清单")
+    parser.add_argument("--hosts-file", default=None, help="主机清单文件，每行一个 IP")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="并发线程数")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="对控制端每秒最多发起的请求数")
+    parser.add_argument("--burst", type=int, default=DEFAULT_BURST, help="限速令牌桶容量")
+    parser.add_argument("--stage-limit", action="append", default=[], metavar="STAGE=N",
+                        help="流水线中某个阶段的并发上限，可重复，如 --stage-limit pull_image=4")
+    parser.add_argument("--vm-per-host", type=int, default=None, help="create_vms: 单台主机同时创建的云机数")
+    parser.add_argument("--vm-global", type=int, default=None, help="create_vms: 所有主机合计同时创建的云机数")
+    parser.add_argument("--rollout", action="store_true",
+                        help="pull_image: 跳过已有镜像的主机，先拉种子批次，再按观察到的耗时自适应调整并发")
+    parser.add_argument("--seed", type=int, default=ROLLOUT_SEED, help="--rollout: 种子批次的主机数")
+    parser.add_argument("--initial-concurrency", type=int, default=ROLLOUT_INITIAL, help="--rollout: 种子批次后的初始并发")
+    parser.add_argument("--max-concurrency", type=int, default=ROLLOUT_MAX, help="--rollout: 并发上限")
+    parser.add_argument("--log-file", default=None, help="同时写入日志文件")
+    parser.add_argument("--run-id", default=None, help="本次运行的 ID（运行日志文件名），默认按时间和操作生成")
+    parser.add_argument("--resume", default=None, metavar="RUN_ID",
+                        help="续跑之前的运行：沿用它的操作和主机清单，跳过已成功的主机 / 阶段")
+    parser.add_argument("--only-failed", action="store_true",
+                        help="只重跑有失败记录的主机（配合 --resume，未指定时取最近一次运行）")
+    return parser
+
+
+def main(argv=None, hosts=None, log_file=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    setup_logging(args.log_file or log_file)
+    hosts = args.hosts or (load_hosts(args.hosts_file) if args.hosts_file else hosts) or load_hosts()
+
+    resume_id = args.resume
+    if args.only_failed and not resume_id:
+        resume_id = latest_run_id()
+    if resume_id:
+        journal = RunJournal(resume_id)
+        if journal.header is None:
+            parser.error(f"找不到运行日志: {journal.path}")
+        if args.operation and args.operation != journal.header["operation"]:
+            parser.error(f"运行 {resume_id} 的操作是 {journal.header['operation']}，与 {args.operation} 不一致")
+        args.operation = journal.header["operation"]
+        if journal.header.get("options", {}).get("rollout") and not args.rollout:
+            logger.info(f"运行 {resume_id} 使用了 --rollout，续跑时沿用")
+            args.rollout = True
+        if not args.hosts and not args.hosts_file:
+            hosts = journal.header["hosts"]
+        if args.only_failed:
+            failed = set(journal.failed_hosts())
+            hosts = [ip for ip in hosts if ip in failed]
+        logger.info(f"续跑 {resume_id}（{args.operation}），日志: {journal.path}")
+    else:
+        if not args.operation:
+            parser.error("需要指定操作，或使用 --resume / --only-failed")
+        journal = RunJournal(args.run_id or new_run_id(args.operation))
+        if journal.header is not None:
+            parser.error(f"运行 {journal.run_id} 已存在，续跑请使用 --resume {journal.run_id}")
+        logger.info(f"运行 ID: {journal.run_id}，日志: {journal.path}（中断后可用 --resume {journal.run_id} 续跑）")
+    stages = None
+    if args.operation not in OPERATIONS:
+        stages = PIPELINES.get(args.operation) or [Stage(name) for name in args.operation.split(",") if name]
+        try:
+            resolve_stages(stages)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.rollout and args.operation != "pull_image":
+        parser.error("--rollout 只适用于 pull_image")
+    stage_limits = {}
+    if args.stage_limit and stages is None:
+        parser.error("--stage-limit 只适用于流水线")
+    stage_names = {stage.name for stage in stages or []}
+    for item in args.stage_limit:
+        name, _, limit = item.partition("=")
+        if name not in stage_names:
+            parser.error(f"--stage-limit {item}: 流水线 {args.operation} 中没有阶段 {name}，可选: {', '.join(sorted(stage_names))}")
+        if not limit.isdigit() or int(limit) < 1:
+            parser.error(f"--stage-limit {item}: 并发上限必须是正整数，格式为 STAGE=N")
+        stage_limits[name] = int(limit)
+
+    done = journal.completed if resume_id else None
+    journal.start(args.operation, hosts, {"rollout": args.rollout})
+    set_vm_limits(args.vm_per_host, args.vm_global)
+    # --rollout 的并发上限可能大于 --workers
+    peak_workers = max(args.workers, args.max_concurrency) if args.rollout else args.workers
+    client = FleetClient(workers=peak_workers, rate=args.rate, burst=args.burst)
+    try:
+        if args.rollout and args.operation == "pull_image":
+            results = rollout_image(hosts, client=client, seed=args.seed, initial=args.initial_concurrency,
+                                    maximum=args.max_concurrency, on_result=journal.record, done=done)
+        elif stages is None:
+            results = run_operation(args.operation, hosts, workers=args.workers, client=client,
+                                    on_result=journal.record, done=done)
+        else:
+            results = run_pipeline(stages, hosts, workers=args.workers, client=client, stage_limits=stage_limits,
+                                   on_result=journal.record, done=done)
+    except KeyboardInterrupt:
+        logger.warning(f"已中断，已完成的主机记录在 {journal.path}，可用 --resume {journal.run_id} 续跑")
+        return 130
+    return 0 if all(result["ok"] for result in results) else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,110 +1,179 @@
-import requests
-import time
-import logging
+"""
+在所有主机的云机实例上执行同一条 ADB Shell 命令。
+主机清单（FLEET_HOSTS_FILE 或内置清单）、对控制端的限速和重试都复用 fleet_runner；
+全局和单台主机各有并发上限，结果边到边打印，最后把相同输出的实例归为一组汇总
+（如 "成功 190 / 失败 5: device offline"），并导出 JSON 报告。
+
+用法示例:
+    python remove_phone_6_adb.py
+    python remove_phone_6_adb.py --cmd "getprop ro.build.version.release" --rate 20 --per-host-limit 3
+    python remove_phone_6_adb.py --hosts 192.168.150.3 192.168.150.4 --mask-numbers --report ping.json
+"""
+import argparse
 import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-BASE_URL = "http://rdcpc3.echoing.cc:10012"
-TIMEOUT = 300
-DELAY_BETWEEN_REQUESTS = 1.0  # 每次请求后等待 1 秒
-
-ips = [
-    "192.168.150.3",
-    "192.168.150.4",
-    "192.168.150.5",
-    "192.168.150.6",
-    "192.168.150.7",
-    "192.168.150.8",
-    "192.168.150.9",
-    "192.168.150.10",
-    "192.168.150.12",
-    "192.168.150.13",
-    "192.168.150.14",
-    "192.168.150.15",
-    "192.168.150.16",
-    "192.168.150.17",
-    "192.168.150.18",
-    "192.168.150.19",
-    "192.168.150.21",
-    "192.168.150.22",
-    "192.168.150.23",
-    "192.168.150.24",
-    "192.168.150.25",
-    "192.168.150.26",
-    "192.168.150.28",
-    "192.168.150.30",
-    "192.168.150.31",
-    "192.168.150.32",
-    "192.168.150.33",
-    "192.168.150.34",
-    "192.168.150.35",
-    "192.168.150.36",
-    "192.168.150.37",
-    "192.168.150.40",
-    "192.168.150.41",
-    "192.168.150.42",
-    "192.168.150.43",
-    "192.168.150.44",
-    "192.168.150.45",
-    "192.168.150.46",
-    "192.168.150.47"
-]
+import fleet_runner
 
 CMD = "ping -c 4 www.goolge.com"
+TIMEOUT = 300
+MAX_RETRIES = 2              # 只在连接没建立起来时重试；请求发出后的超时 / 断开不重试，避免命令重复执行
+INSTANCES_PER_HOST = fleet_runner.VM_SLOTS
+GLOBAL_CONCURRENCY = 50      # 同时在执行的命令总数上限
+PER_HOST_CONCURRENCY = 5     # 同一台主机上同时执行的命令数上限
+REPORT_FILE = "execute_shell_report.json"
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("execute_shell.log", encoding="utf-8"),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
-def execute_adb_shell(ip, name):
-    url = f"{BASE_URL}/and_api/v1/shell/{ip}/{name}"
-    headers = {
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "cmd": CMD
-    }
 
+def parse_shell_response(status, text):
+    """
+    控制端返回 {"code": 200, "msg": 输出}，code 不是 200 或 HTTP 状态码不是 200 都算失败。
+    返回 (是否成功, 输出或错误信息)。
+    """
+    text = text.strip()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return status == 200, text if status == 200 else f"HTTP {status}: {text}"
+    if not isinstance(data, dict):
+        return status == 200, text
+    output = data.get("msg", text)
+    if not isinstance(output, str):
+        output = json.dumps(output, ensure_ascii=False)
+    ok = status == 200 and data.get("code", 200) == 200
+    return ok, output.strip()
+
+
+def execute_adb_shell(client, ip, name, cmd):
+    url = f"{fleet_runner.BASE_URL}/and_api/v1/shell/{ip}/{name}"
+    result = {"host": ip, "instance": name, "status": None, "attempts": 1}
+    start_time = time.time()
     try:
-        logger.info(f"执行命令: {ip}/{name} → {CMD}")
-        response = requests.post(url, json=payload, headers=headers, timeout=TIMEOUT)
-
-        result_text = response.text.strip()
-        logger.info(f"响应: [{response.status_code}] {result_text}")
-        print(f"{ip}/{name} → {result_text}")
-
-    except requests.exceptions.Timeout:
-        logger.error(f"超时: {ip}/{name}")
-        print(f"{ip}/{name} → 请求超时")
-    except requests.exceptions.ConnectionError:
-        logger.error(f"连接失败: {ip}/{name}")
-        print(f"{ip}/{name} → 连接失败")
+        # 任何 HTTP 状态码都由 parse_shell_response 判断，FleetClient 只负责限速和建立连接失败时的重试
+        response, result["attempts"] = client.request(
+            "POST", url, json={"cmd": cmd}, ok_statuses=range(100, 600), timeout=TIMEOUT,
+            max_retries=MAX_RETRIES, connect_only=True
+        )
+        result["status"] = response.status_code
+        result["ok"], result["output"] = parse_shell_response(response.status_code, response.text)
+    except fleet_runner.FleetError as e:
+        result.update(ok=False, output=str(e), attempts=e.attempts)
     except Exception as e:
-        logger.error(f"未知错误: {ip}/{name} → {e}")
-        print(f"{ip}/{name} → 发生错误: {e}")
+        result.update(ok=False, output=f"发生错误: {e}")
+    result["elapsed"] = round(time.time() - start_time, 3)
+    return result
 
-if __name__ == "__main__":
-    total_ips = len(ips)
-    total_commands = total_ips * 5
-    logger.info(f"开始为 {total_ips} 台主机 × 5 实例 = {total_commands} 次命令执行...")
 
-    count = 0
-    for idx, ip in enumerate(ips, 1):
-        print(f"\n=== [{idx}/{total_ips}] 处理主机: {ip} ===")
-        logger.info(f"======== [{idx}/{total_ips}] 处理主机: {ip} ========")
+def fan_out(cmd, hosts, instances=INSTANCES_PER_HOST, global_limit=GLOBAL_CONCURRENCY,
+            per_host_limit=PER_HOST_CONCURRENCY, client=None, on_result=None):
+    """
+    在 hosts × instances 个实例上并发执行 cmd，每完成一个就回调 on_result（在工作线程中），
+    返回全部结果（按主机、实例排序）。请求经过 FleetClient，对控制端的限速和其他批量操作一致。
+    任务按实例序号轮流分配到各主机，排队等同一台主机的任务尽量不占全局并发。
+    """
+    client = client or fleet_runner.FleetClient(workers=global_limit)
+    host_semaphores = {ip: threading.BoundedSemaphore(per_host_limit) for ip in hosts}
+    order = {ip: index for index, ip in enumerate(hosts)}
+
+    def run_one(ip, name):
+        with host_semaphores[ip]:
+            result = execute_adb_shell(client, ip, name, cmd)
+        if on_result:
+            on_result(result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=global_limit) as executor:
+        futures = [executor.submit(run_one, ip, f"{ip}T100{i}") for i in range(1, instances + 1) for ip in hosts]
+        results = [future.result() for future in as_completed(futures)]
+    return sorted(results, key=lambda result: (order[result["host"]], result["instance"]))
+
+
+def group_results(results, mask_numbers=False):
+    """
+    按 (是否成功, 输出) 分组，数量多的在前。mask_numbers 时把数字替换成 N 再比较，
+    像 ping 这种只有耗时不同的输出也能归到一组。
+    """
+    groups = {}
+    for result in results:
+        key_output = re.sub(r"\d+(\.\d+)?", "N", result["output"]) if mask_numbers else result["output"]
+        group = groups.setdefault((result["ok"], key_output), {
+            "ok": result["ok"], "output": key_output, "count": 0, "instances": []
+        })
+        group["count"] += 1
+        group["instances"].append(result["instance"])
+    return sorted(groups.values(), key=lambda group: (not group["ok"], -group["count"]))
+
+
+def print_summary(results, groups, elapsed):
+    success = sum(1 for result in results if result["ok"])
+    print(f"\n=== 共 {len(results)} 个实例，成功 {success}，失败 {len(results) - success}，耗时 {elapsed:.1f} 秒 ===")
+    for group in groups:
+        lines = group["output"].splitlines() or [""]
+        summary = lines[0][:200] + (" …" if len(lines) > 1 or len(lines[0]) > 200 else "")
+        label = "成功" if group["ok"] else "失败"
+        sample = ", ".join(group["instances"][:3]) + (" 等" if group["count"] > 3 else "")
+        print(f"[{label} {group['count']}] {summary}  ({sample})")
+
+
+def write_report(path, cmd, results, groups, elapsed):
+    report = {
+        "cmd": cmd,
+        "finished_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "elapsed": round(elapsed, 3),
+        "total": len(results),
+        "ok": sum(1 for result in results if result["ok"]),
+        "failed": sum(1 for result in results if not result["ok"]),
+        "groups": groups,
+        "results": results
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="在所有云机实例上执行 ADB Shell 命令")
+    parser.add_argument("--cmd", default=CMD, help="要执行的命令")
+    parser.add_argument("--hosts", nargs="+", default=None, help="只在这些主机上执行，默认使用 fleet_runner 的主机清单")
+    parser.add_argument("--hosts-file", default=None, help="主机清单文件，每行一个 IP")
+    parser.add_argument("--instances", type=int, default=INSTANCES_PER_HOST, help="每台主机的实例数")
+    parser.add_argument("--global-limit", type=int, default=GLOBAL_CONCURRENCY, help="全局并发上限")
+    parser.add_argument("--per-host-limit", type=int, default=PER_HOST_CONCURRENCY, help="单台主机并发上限")
+    parser.add_argument("--rate", type=float, default=fleet_runner.DEFAULT_RATE, help="对控制端每秒最多发起的请求数")
+    parser.add_argument("--burst", type=int, default=fleet_runner.DEFAULT_BURST, help="限速令牌桶容量")
+    parser.add_argument("--mask-numbers", action="store_true", help="分组时忽略输出中的数字（耗时、序号等）")
+    parser.add_argument("--report", default=REPORT_FILE, help="JSON 报告的输出路径")
+    args = parser.parse_args()
 
-        for i in range(1, 6):
-            name = f"{ip}T100{i}"
-            count += 1
-            logger.info(f"[{count}/{total_commands}] → {ip}/{name}")
+    fleet_runner.setup_logging("execute_shell.log")
+    hosts = args.hosts or fleet_runner.load_hosts(args.hosts_file)
+    total_commands = len(hosts) * args.instances
+    logger.info(f"开始为 {len(hosts)} 台主机 × {args.instances} 实例 = {total_commands} 次命令执行"
+                f"（全局并发 {args.global_limit}，单机并发 {args.per_host_limit}，限速 {args.rate}/s）: {args.cmd}")
+    progress_lock = threading.Lock()
+    finished = 0
 
-            execute_adb_shell(ip, name)
-            time.sleep(DELAY_BETWEEN_REQUESTS)  # 每次请求后等 1 秒
+    def report_progress(result):
+        global finished
+        with progress_lock:
+            finished += 1
+            index = finished
+        if result["ok"]:
+            logger.info(f"[{index}/{total_commands}] {result['instance']} → {result['output']}")
+        else:
+            logger.error(f"[{index}/{total_commands}] {result['instance']} → {result['output']}")
 
-    logger.info(" 所有命令执行完成！")
-    print(f"\n 共执行 {total_commands} 次 ADB Shell 命令，任务已完成！")
\ No newline at end of file
+    client = fleet_runner.FleetClient(workers=args.global_limit, rate=args.rate, burst=args.burst)
+    start_time = time.time()
+    results = fan_out(args.cmd, hosts, args.instances, args.global_limit, args.per_host_limit,
+                      client=client, on_result=report_progress)
+    elapsed = time.time() - start_time
+    groups = group_results(results, args.mask_numbers)
+    print_summary(results, groups, elapsed)
+    write_report(args.report, args.cmd, results, groups, elapsed)
+    print(f"报告已写入 {args.report}")
+    raise SystemExit(0 if all(result["ok"] for result in results) else 1)